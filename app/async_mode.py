@@ -0,0 +1,33 @@
+"""
+Modo de atendimento assíncrono (gevent).
+
+Cada requisição vira um greenlet; o psycopg2 cede o loop enquanto espera o
+Postgres (psycogreen) e OCR/parse rodam em processos separados (app.workers).
+Um único processo segura centenas de clientes lentos (uploads em rede ruim)
+sem travar gráficos e listagens.
+
+    gunicorn -k gevent --worker-connections 500 app.async_mode:app
+
+Requer gevent e, com DB_BACKEND=postgres, psycogreen. Ajuste DB_POOL_MAX
+para o número de conexões simultâneas desejado: requisições além disso
+esperam na fila do pool.
+"""
+import os
+from gevent import monkey
+from . import config
+
+if config.CPU_WORKERS <= 0:
+    config.CPU_WORKERS = os.cpu_count() or 2
+
+# gunicorn -k gevent já aplicou o patch antes de importar o app; fora dele
+# (outros servidores, testes) aplica aqui. O pool de processos do
+# app.workers nasce depois, com threading e select cooperativos.
+if not monkey.is_module_patched("socket"):
+    monkey.patch_all()
+
+if config.DB_BACKEND == "postgres":
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+
+from .routes import app
@@ -0,0 +1,44 @@
+from __future__ import annotations
+import os
+import tempfile
+from typing import Optional, Tuple
+from . import config
+
+# Armazenamento dos arquivos originais endereçado pelo conteúdo:
+# BLOB_DIR/ab/cd/<sha256>. Reenviar o mesmo arquivo não grava nada de novo;
+# quem referencia cada blob (e quantas vezes) fica na tabela blobs.
+
+def blob_path(sha: str) -> str:
+    return os.path.join(config.BLOB_DIR, sha[:2], sha[2:4], sha)
+
+def put_blob(sha: str, data: bytes) -> Tuple[str, bool]:
+    """
+    Grava o conteúdo se ainda não existir (escrita atômica via arquivo
+    temporário + rename). Retorna (caminho, gravou?). Chame depois de
+    register_blob, que protege o blob da coleta (gc-blobs).
+    """
+    path = blob_path(sha)
+    if os.path.exists(path):
+        return path, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Temporário único: duas requisições podem enviar o mesmo arquivo
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(path), prefix=f"{sha}.",
+                                     suffix=".tmp", delete=False) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, path)
+    return path, True
+
+def delete_blob(sha: str) -> bool:
+    try:
+        os.remove(blob_path(sha))
+        return True
+    except FileNotFoundError:
+        return False
+
+def existing_path(sha: Optional[str]) -> Optional[str]:
+    if not sha:
+        return None
+    path = blob_path(sha)
+    return path if os.path.exists(path) else None
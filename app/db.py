@@ -1,22 +1,65 @@
 from __future__ import annotations
 import json
-from typing import Optional, Tuple
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import psycopg2
+import psycopg2.errors
 from psycopg2 import pool
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
 from . import config
+from .fingerprints import result_fingerprint, source_sha
+from .parsing.parse import normalize_name
+from .constants import REF_RANGES
+from .storage.base import DuplicateExamError, ReparseUpdate
+from . import stats
 
-POOL: Optional[pool.SimpleConnectionPool] = None
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """
+    Pool que espera (até DB_POOL_TIMEOUT) por uma conexão livre em vez de
+    levantar PoolError quando todas estão em uso. Seguro para threads e,
+    com o gevent aplicado (app.async_mode), para greenlets.
+    """
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        t0 = time.perf_counter()
+        acquired = self._slots.acquire(timeout=config.DB_POOL_TIMEOUT)
+        _POOL_WAIT.ms = getattr(_POOL_WAIT, "ms", 0.0) + (time.perf_counter() - t0) * 1000
+        if not acquired:
+            raise pool.PoolError("tempo esgotado esperando conexão do pool")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+# Tempo acumulado esperando conexão, por thread/greenlet (ver routes: X-Pool-Wait-Ms)
+_POOL_WAIT = threading.local()
+
+def reset_pool_wait() -> None:
+    _POOL_WAIT.ms = 0.0
 
-def get_pool() -> pool.SimpleConnectionPool:
+def pool_wait_ms() -> float:
+    return getattr(_POOL_WAIT, "ms", 0.0)
+
+POOL: Optional[BlockingConnectionPool] = None
+
+def get_pool() -> BlockingConnectionPool:
     """
     Cria (uma vez) e retorna o pool de conexões.
     Garante schema ao inicializar.
     """
     global POOL
     if POOL is None:
-        POOL = psycopg2.pool.SimpleConnectionPool(
-            1, 10,
+        POOL = BlockingConnectionPool(
+            config.DB_POOL_MIN, config.DB_POOL_MAX,
             host=config.DB_HOST,
             port=config.DB_PORT,
             dbname=config.DB_NAME,
@@ -47,6 +90,25 @@ def init_db():
                 data JSONB NOT NULL
             );
             """)
+            # Impressões digitais para reingestão idempotente (upserts)
+            cur.execute("ALTER TABLE exams ADD COLUMN IF NOT EXISTS source_fp TEXT;")
+            cur.execute("ALTER TABLE exams ADD COLUMN IF NOT EXISTS result_fp TEXT;")
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS exams_source_fp_uq ON exams (source_fp);")
+            # result_fp só localiza exames parecidos (aviso); não impede gravar:
+            # pacientes diferentes ou um exame repetido podem ter o mesmo resultado
+            cur.execute("DROP INDEX IF EXISTS exams_result_fp_uq;")
+            cur.execute("CREATE INDEX IF NOT EXISTS exams_result_fp_idx ON exams (result_fp);")
+            # Última leitura do parser: o reprocessamento só troca valores que ainda são dela
+            cur.execute("ALTER TABLE exams ADD COLUMN IF NOT EXISTS parsed JSONB;")
+            # Busca aproximada de pacientes (nome sem acento + trigramas)
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            cur.execute("ALTER TABLE exams ADD COLUMN IF NOT EXISTS patient_name_norm TEXT;")
+            # GiST (não GIN): além do filtro <%, devolve em ordem de distância (<->>)
+            cur.execute("DROP INDEX IF EXISTS exams_patient_name_trgm;")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS exams_patient_name_trgm_gist
+                ON exams USING gist (patient_name_norm gist_trgm_ops);
+            """)
             cur.execute("""
             CREATE TABLE IF NOT EXISTS ref_ranges (
                 id SERIAL PRIMARY KEY,
@@ -59,95 +121,87 @@ def init_db():
                 ref_high DOUBLE PRECISION
             );
             """)
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size BIGINT NOT NULL,
+                content_type TEXT,
+                filename TEXT,
+                refcount INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+            """)
+            cur.execute("ALTER TABLE exams ADD COLUMN IF NOT EXISTS blob_sha TEXT REFERENCES blobs (sha256);")
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS analyte_stats (
+                analyte TEXT NOT NULL,
+                age_band INT NOT NULL,
+                sex TEXT NOT NULL,
+                n BIGINT NOT NULL DEFAULT 0,
+                mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+                m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+                sketch JSONB NOT NULL DEFAULT '{"z": 0, "b": {}}',
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (analyte, age_band, sex)
+            );
+            """)
         seed_reference_ranges(conn)
+        bootstrap_analyte_stats(conn)
     finally:
         db_put(conn)
 
+def backfill_patient_name_norm(batch: int = 1000, limit: Optional[int] = None) -> int:
+    """
+    Preenche patient_name_norm de exames antigos (normalização em Python,
+    a mesma usada na gravação), um lote por transação. Roda pelo comando
+    backfill-names, fora das requisições; retorna quantos foram preenchidos.
+    """
+    done = 0
+    conn = db_conn()
+    try:
+        while limit is None or done < limit:
+            step = batch if limit is None else min(batch, limit - done)
+            with conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, patient_name FROM exams
+                    WHERE patient_name_norm IS NULL AND patient_name IS NOT NULL
+                    ORDER BY id LIMIT %s
+                """, (step,))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                execute_values(cur, """
+                    UPDATE exams AS e SET patient_name_norm = v.norm
+                    FROM (VALUES %s) AS v(id, norm) WHERE e.id = v.id
+                """, [(rid, normalize_name(name)) for rid, name in rows], page_size=step)
+            done += len(rows)
+    finally:
+        db_put(conn)
+    return done
+
+def bootstrap_analyte_stats(conn):
+    """
+    Banco com exames anteriores às estatísticas: analyte_stats vazia. Os
+    deltas de edição/exclusão tirariam amostras nunca somadas, então a
+    tabela é construída por inteiro antes do primeiro uso.
+    """
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT NOT EXISTS (SELECT 1 FROM analyte_stats) AND EXISTS (SELECT 1 FROM exams)")
+        needed = cur.fetchone()[0]
+    if needed:
+        with conn:
+            _rebuild_stats(conn)
+
 def seed_reference_ranges(conn):
     with conn, conn.cursor() as cur:
         cur.execute("SELECT COUNT(*) FROM ref_ranges;")
         count = cur.fetchone()[0]
         if count and count > 0:
             return
-        refs = [
-            # analyte, unit, age_min, age_max, sex, low, high
-            ("GLU", "mg/dL", 18, 110, None, 70, 99),
-            ("URE", "mg/dL", 18, 110, None, 15, 50),
-            ("CRE", "mg/dL", 18, 110, None, 0.6, 1.2),
-            ("PCR", "mg/dL", 18, 110, None, 0.0, 0.5),
-            ("CA", "mg/dL", 18, 110, None, 8.6, 10.0),
-            ("P", "mg/dL", 18, 110, None, 2.7, 4.5),
-            ("AST", "U/L", 18, 110, None, 10, 40),
-            ("ALT", "U/L", 18, 110, None, 7, 55),
-            ("ALP", "U/L", 18, 110, None, 46, 116),
-            ("GGT", "U/L", 18, 110, None, 1, 38),
-            ("AML", "U/L", 18, 110, None, 20, 104),
-            ("FE", "µg/dL", 18, 110, None, 60, 170),
-            ("TIBC", "µg/dL", 18, 110, None, 250, 400),
-            ("TRF", "µg/dL", 18, 110, None, 155, 355),
-            ("CT", "mg/dL", 18, 110, None, 0, 190),
-            ("TG", "mg/dL", 18, 110, None, 0, 150),
-            ("HDL", "mg/dL", 18, 110, None, 40, 200),
-            ("VLDL", "mg/dL", 18, 110, None, 5, 40),
-            ("LDL", "mg/dL", 18, 110, None, 0, 130),
-            ("ALB", "g/dL", 18, 110, None, 3.4, 4.8),
-            ("PT", "g/dL", 18, 110, None, 6.4, 8.3),
-            ("A_G", "razão", 18, 110, None, 0.8, 2.2),
-            ("ALB_PCT", "%", 18, 110, None, 55.8, 66.1),
-            ("A1", "%", 18, 110, None, 2.9, 4.9),
-            ("A2", "%", 18, 110, None, 7.1, 11.8),
-            ("B1", "%", 18, 110, None, 4.9, 7.2),
-            ("B2", "%", 18, 110, None, 3.1, 6.1),
-            ("GAMMA", "%", 18, 110, None, 11.1, 18.8),
-            ("HBA1C", "%", 18, 110, None, 4.5, 5.6),
-            ("RBC", "10^6/mm3", 18, 110, None, 4.5, 6.0),
-            ("HGB", "g/dL", 18, 110, None, 13.0, 17.0),
-            ("HCT", "%", 18, 110, None, 40.0, 50.0),
-            ("MCV", "fL", 18, 110, None, 82, 98),
-            ("MCH", "pg", 18, 110, None, 27, 32),
-            ("MCHC", "g/dL", 18, 110, None, 32, 36),
-            ("RDW", "%", 18, 110, None, 10, 15),
-            ("WBC", "/mm3", 18, 110, None, 4000, 10000),
-            ("BAND", "%", 18, 110, None, 0, 4),
-            ("SEG", "%", 18, 110, None, 40, 65),
-            ("EOS", "%", 18, 110, None, 1, 5),
-            ("BASO", "%", 18, 110, None, 0, 1),
-            ("LYMPH", "%", 18, 110, None, 20, 40),
-            ("LYMPH_ATYP", "%", 18, 110, None, 0, 1),
-            ("MONO", "%", 18, 110, None, 2, 12),
-            ("PLT", "/mm3", 18, 110, None, 150000, 450000),
-            ("MPV", "fL", 18, 110, None, 9.2, 12.6),
-            ("E2", "pg/mL", 18, 110, None, 0, 40),
-            ("FSH", "mUI/mL", 18, 110, None, 1.4, 18.1),
-            ("INS", "µUI/mL", 18, 110, None, 2.0, 20.0),
-            ("HOMA_IR", "índice", 18, 110, None, 0.0, 3.4),
-            ("LH", "mUI/mL", 18, 110, None, 1.5, 9.3),
-            ("PTH", "pg/mL", 18, 110, None, 12, 65),
-            ("PROG", "ng/mL", 18, 110, None, 0.28, 1.22),
-            ("PRL", "ng/mL", 18, 110, None, 2.1, 17.7),
-            ("TESTO", "ng/dL", 18, 110, None, 300, 1000),
-            ("TSH", "µUI/mL", 18, 110, None, 0.55, 4.78),
-            ("FT4", "ng/dL", 18, 110, None, 0.70, 1.76),
-            ("FOLATE", "ng/mL", 18, 110, None, 3.0, 17.0),
-            ("ANTI_TPO", "UI/mL", 18, 110, None, 0, 60),
-            ("ANTI_TG", "UI/mL", 18, 110, None, 0, 4.5),
-            ("CA15_3", "U/mL", 18, 110, None, 0, 38),
-            ("CA19_9", "U/mL", 18, 110, None, 0, 37),
-            ("FER", "ng/mL", 18, 110, None, 22, 322),
-            ("B12", "pg/mL", 18, 110, None, 193, 982),
-            ("VITD", "ng/mL", 18, 110, None, 30, 100),
-            ("CEA", "ng/mL", 18, 110, None, 0, 2.5),
-            ("CA125", "U/mL", 18, 110, None, 0, 30.2),
-            ("CORT", "µg/dL", 18, 110, None, 5.27, 22.45),
-            ("C_PEP", "ng/mL", 18, 110, None, 1.10, 4.40),
-            ("SHBG", "nmol/L", 18, 110, None, 10, 57),
-            ("TESTO_FREE", "ng/dL", 18, 110, None, 3.0, 25.0),
-            ("RT3", "ng/dL", 18, 110, None, 31, 95),
-        ]
         cur.executemany("""
             INSERT INTO ref_ranges (analyte, unit, age_min, age_max, sex, ref_low, ref_high)
             VALUES (%s,%s,%s,%s,%s,%s,%s);
-        """, refs)
+        """, REF_RANGES)
 
 def find_ref(analyte: str, age: int, sex: Optional[str]) -> Tuple[Optional[float], Optional[float], Optional[str]]:
     conn = db_conn()
@@ -173,3 +227,520 @@ def find_ref(analyte: str, age: int, sex: Optional[str]) -> Tuple[Optional[float
             return None, None, None
     finally:
         db_put(conn)
+
+def insert_exams(exams: List[Dict[str, Any]]) -> List[Tuple[int, bool]]:
+    """
+    Insere vários exames em um único INSERT (execute_values) com
+    ON CONFLICT DO NOTHING sobre source_fp: reimportar o mesmo documento
+    não duplica linhas nem gera versões mortas no índice.
+    Devolve [(id, inserido?)] na mesma ordem de entrada.
+    Cada item: patient_name, sex, age_years, data e, opcionais, source_fp
+    e parsed (saída do parser para o documento).
+    Em cada item ficam result_fp e same_result_as (id de um exame já
+    gravado com resultado idêntico, para aviso; None se não houver).
+    """
+    if not exams:
+        return []
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            # Liga ao arquivo original quando o hash da fonte já está em blobs
+            # (FOR SHARE: a coleta de blobs não apaga a linha até o commit)
+            shas = list({source_sha(e.get("source_fp")) for e in exams} - {None})
+            stored = set()
+            if shas:
+                cur.execute("SELECT sha256 FROM blobs WHERE sha256 = ANY(%s) FOR SHARE", (shas,))
+                stored = {r[0] for r in cur.fetchall()}
+            for e in exams:
+                e["result_fp"] = result_fingerprint(e.get("patient_name"), e.get("sex"), e["age_years"], e["data"])
+                sha = source_sha(e.get("source_fp"))
+                e["blob_sha"] = sha if sha in stored else None
+            cur.execute("SELECT result_fp, MIN(id) FROM exams WHERE result_fp = ANY(%s) GROUP BY result_fp",
+                        (list({e["result_fp"] for e in exams}),))
+            same = dict(cur.fetchall())
+            for e in exams:
+                e["same_result_as"] = same.get(e["result_fp"])
+            rows = [(e.get("patient_name"), normalize_name(e.get("patient_name")), e.get("sex"),
+                     e["age_years"], Json(e["data"]), e.get("source_fp"), e["result_fp"], e["blob_sha"],
+                     Json(e["parsed"]) if e.get("parsed") is not None else None)
+                    for e in exams]
+            res = execute_values(cur, """
+                INSERT INTO exams (patient_name, patient_name_norm, sex, age_years, data,
+                                   source_fp, result_fp, blob_sha, parsed, created_at, updated_at)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                RETURNING id, source_fp
+            """, rows, template="(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW(),NOW())", page_size=len(rows), fetch=True)
+            # Sem source_fp não há conflito: essas linhas voltam todas, na ordem do VALUES
+            by_source = {sfp: rid for rid, sfp in res if sfp}
+            no_source = iter([rid for rid, sfp in res if not sfp])
+
+            missing = [e["source_fp"] for e in exams if e.get("source_fp") and e["source_fp"] not in by_source]
+            existing: Dict[str, int] = {}
+            if missing:
+                cur.execute("SELECT source_fp, id FROM exams WHERE source_fp = ANY(%s)", (missing,))
+                existing = dict(cur.fetchall())
+
+            out: List[Tuple[int, bool]] = []
+            deltas = []
+            refs: Dict[str, int] = {}
+            seen = set()
+            for e in exams:
+                sfp = e.get("source_fp")
+                if not sfp:
+                    rid, new = next(no_source), True
+                elif sfp in by_source and sfp not in seen:
+                    seen.add(sfp)
+                    rid, new = by_source[sfp], True
+                else:
+                    rid, new = by_source.get(sfp) or existing.get(sfp), False
+                out.append((rid, new))
+                if new:
+                    deltas.extend(stats.exam_deltas(e.get("sex"), e["age_years"], e["data"], +1))
+                    if e["blob_sha"]:
+                        refs[e["blob_sha"]] = refs.get(e["blob_sha"], 0) + 1
+            _apply_stats_deltas(cur, deltas)
+            _adjust_blob_refs(cur, refs)
+            return out
+    finally:
+        db_put(conn)
+
+def _adjust_blob_refs(cur, refs: Dict[str, int]) -> None:
+    if refs:
+        execute_values(cur, """
+            UPDATE blobs AS b SET refcount = b.refcount + v.delta
+            FROM (VALUES %s) AS v(sha256, delta) WHERE b.sha256 = v.sha256
+        """, sorted(refs.items()))
+
+def register_blob(sha: str, size: int, content_type: Optional[str], filename: Optional[str]) -> None:
+    """
+    Registra o arquivo original (sem referências ainda). Reenviar renova
+    created_at, para a coleta não apagar o blob antes de o exame ser salvo.
+    Se a coleta estiver apagando esta linha, espera o commit dela e recria.
+    """
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO blobs (sha256, size, content_type, filename)
+                VALUES (%s,%s,%s,%s) ON CONFLICT (sha256) DO UPDATE SET created_at = NOW()
+            """, (sha, size, content_type, filename))
+    finally:
+        db_put(conn)
+
+def get_exam_blob(exam_id: int) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    (sha256, content_type, filename) do arquivo original do exame, se houver.
+    """
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT b.sha256, b.content_type, b.filename
+                FROM exams e JOIN blobs b ON b.sha256 = e.blob_sha
+                WHERE e.id=%s
+            """, (exam_id,))
+            return cur.fetchone()
+    finally:
+        db_put(conn)
+
+def collect_unreferenced_blobs(grace_hours: float, remove: Callable[[str], Any],
+                               batch: int = 500) -> List[str]:
+    """
+    Remove os blobs sem referências há mais de grace_hours (uploads
+    importados mas nunca salvos) e devolve seus hashes. remove(sha) apaga o
+    arquivo ainda dentro da transação, com a linha travada: um reenvio
+    (register_blob) ou um exame novo (insert_exams) espera o commit em vez
+    de apontar para um arquivo que está sumindo. O DELETE reconfere
+    refcount na versão travada da linha; lotes curtos limitam a espera.
+    """
+    removed: List[str] = []
+    conn = db_conn()
+    try:
+        while True:
+            with conn, conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM blobs
+                    WHERE sha256 IN (
+                        SELECT sha256 FROM blobs
+                        WHERE refcount <= 0 AND created_at < NOW() - make_interval(secs => %s)
+                        LIMIT %s FOR UPDATE SKIP LOCKED
+                    )
+                      AND refcount <= 0 AND created_at < NOW() - make_interval(secs => %s)
+                      AND NOT EXISTS (SELECT 1 FROM exams e WHERE e.blob_sha = blobs.sha256)
+                    RETURNING sha256
+                """, (grace_hours * 3600, batch, grace_hours * 3600))
+                shas = [r[0] for r in cur.fetchall()]
+                for sha in shas:
+                    remove(sha)
+            removed += shas
+            if len(shas) < batch:
+                return removed
+    finally:
+        db_put(conn)
+
+def update_exam(exam_id: int, exam: Dict[str, Any]) -> bool:
+    """
+    Atualiza um exame (recalcula result_fp; source_fp só muda se informado).
+    Levanta DuplicateExamError se o source_fp já pertencer a outro exame.
+    """
+    rfp = result_fingerprint(exam.get("patient_name"), exam.get("sex"), exam["age_years"], exam["data"])
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT sex, age_years, data::text FROM exams WHERE id=%s FOR UPDATE", (exam_id,))
+            old = cur.fetchone()
+            if not old:
+                return False
+            cur.execute("""
+                UPDATE exams SET patient_name=%s, patient_name_norm=%s, sex=%s, age_years=%s, data=%s,
+                    source_fp=COALESCE(%s, source_fp), result_fp=%s, updated_at=NOW()
+                WHERE id=%s
+            """, (exam.get("patient_name"), normalize_name(exam.get("patient_name")), exam.get("sex"), exam["age_years"], Json(exam["data"]),
+                  exam.get("source_fp"), rfp, exam_id))
+            _apply_stats_deltas(cur,
+                stats.exam_deltas(old[0], old[1], json.loads(old[2]), -1)
+                + stats.exam_deltas(exam.get("sex"), exam["age_years"], exam["data"], +1))
+            return True
+    except psycopg2.errors.UniqueViolation as e:
+        raise DuplicateExamError(str(e)) from e
+    finally:
+        db_put(conn)
+
+def remove_exam(exam_id: int) -> bool:
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM exams WHERE id=%s RETURNING sex, age_years, data::text, blob_sha", (exam_id,))
+            row = cur.fetchone()
+            if not row:
+                return False
+            _apply_stats_deltas(cur, stats.exam_deltas(row[0], row[1], json.loads(row[2]), -1))
+            if row[3]:
+                _adjust_blob_refs(cur, {row[3]: -1})
+            return True
+    finally:
+        db_put(conn)
+
+def _apply_stats_deltas(cur, deltas: List[Tuple[stats.Key, float, int]]) -> None:
+    """
+    Aplica amostras (+1/-1) em analyte_stats dentro da transação corrente.
+    As linhas afetadas são travadas em ordem fixa para evitar deadlocks.
+    """
+    if not deltas:
+        return
+    keys = sorted({k for k, _, _ in deltas})
+    execute_values(cur, """
+        INSERT INTO analyte_stats (analyte, age_band, sex) VALUES %s
+        ON CONFLICT DO NOTHING
+    """, keys, page_size=len(keys))
+    cur.execute("""
+        SELECT analyte, age_band, sex, n, mean, m2, sketch::text FROM analyte_stats
+        WHERE (analyte, age_band, sex) IN %s
+        ORDER BY analyte, age_band, sex
+        FOR UPDATE
+    """, (tuple(keys),))
+    accs: Dict[stats.Key, Dict[str, Any]] = {}
+    for a, b, sx, n, mean, m2, sketch in cur.fetchall():
+        accs[(a, b, sx)] = {"n": n, "mean": mean, "m2": m2, "sketch": json.loads(sketch)}
+    stats.accumulate(accs, deltas)
+    execute_values(cur, """
+        UPDATE analyte_stats AS s
+        SET n=v.n, mean=v.mean, m2=v.m2, sketch=v.sketch::jsonb, updated_at=NOW()
+        FROM (VALUES %s) AS v(analyte, age_band, sex, n, mean, m2, sketch)
+        WHERE s.analyte=v.analyte AND s.age_band=v.age_band AND s.sex=v.sex
+    """, [(*k, a["n"], a["mean"], a["m2"], json.dumps(a["sketch"])) for k, a in accs.items()],
+        page_size=len(accs))
+
+def _rebuild_stats(conn) -> int:
+    """
+    Recalcula analyte_stats do zero a partir de exams (reconstrução periódica).
+    Trava a tabela de estatísticas: gravações concorrentes esperam e aplicam
+    seus deltas depois. Retorna o número de linhas de estatística.
+    """
+    cur = conn.cursor()
+    cur.execute("LOCK TABLE analyte_stats IN EXCLUSIVE MODE")
+    accs: Dict[stats.Key, Dict[str, Any]] = {}
+    with conn.cursor(name="analyte_stats_rebuild") as scan:
+        scan.itersize = 2000
+        scan.execute("SELECT sex, age_years, data::text FROM exams")
+        for sex, age, data in scan:
+            stats.accumulate(accs, stats.exam_deltas(sex, age, json.loads(data), +1))
+    cur.execute("DELETE FROM analyte_stats")
+    if accs:
+        execute_values(cur, """
+            INSERT INTO analyte_stats (analyte, age_band, sex, n, mean, m2, sketch, updated_at)
+            VALUES %s
+        """, [(*k, a["n"], a["mean"], a["m2"], Json(a["sketch"])) for k, a in accs.items()],
+            template="(%s,%s,%s,%s,%s,%s,%s,NOW())", page_size=1000)
+    return len(accs)
+
+def _load_stats(cur, sex: Optional[str], age: int, analytes: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Lê, numa consulta, os acumuladores da faixa etária do exame:
+    {analito: {sexo: acc}} com sexo em (sexo do exame, '*').
+    """
+    if not analytes:
+        return {}
+    sexes = stats.sexes_for(sex)
+    cur.execute("""
+        SELECT analyte, sex, n, mean, m2, sketch::text FROM analyte_stats
+        WHERE age_band=%s AND sex = ANY(%s) AND analyte = ANY(%s)
+    """, (stats.age_band(age), sexes, analytes))
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for a, sx, n, mean, m2, sketch in cur.fetchall():
+        out.setdefault(a, {})[sx] = {"n": n, "mean": mean, "m2": m2, "sketch": json.loads(sketch)}
+    return out
+
+def rebuild_analyte_stats() -> int:
+    conn = db_conn()
+    try:
+        with conn:
+            return _rebuild_stats(conn)
+    finally:
+        db_put(conn)
+
+def load_population_stats(sex: Optional[str], age: int, analytes: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            return _load_stats(cur, sex, age, analytes)
+    finally:
+        db_put(conn)
+
+def search_patients(q: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Busca aproximada por nome: compara o texto normalizado (sem acentos) por
+    trigramas (pg_trgm, índice GiST) e ordena pela similaridade, tolerando
+    erros de OCR. Retorna os exames encontrados, mais parecidos primeiro.
+
+    A ordem vem do próprio índice (KNN por <->>, distância = 1 -
+    word_similarity): mesmo em nomes comuns só os `limit` melhores são
+    lidos, e os desempates só reordenam empates de score.
+    """
+    qn = normalize_name(q)
+    if not qn:
+        return []
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                        (str(config.SEARCH_MIN_SIMILARITY),))
+            cur.execute("""
+                SELECT id, patient_name, sex, age_years, created_at, updated_at,
+                       word_similarity(%s, patient_name_norm) AS score
+                FROM exams
+                WHERE %s <%% patient_name_norm
+                ORDER BY patient_name_norm <->> %s, similarity(%s, patient_name_norm) DESC, id DESC
+                LIMIT %s
+            """, (qn, qn, qn, qn, limit))
+            return [
+                {
+                    "id": r[0],
+                    "patient_name": r[1],
+                    "sex": r[2],
+                    "age_years": r[3],
+                    "created_at": r[4].isoformat(),
+                    "updated_at": r[5].isoformat(),
+                    "score": round(float(r[6]), 3),
+                } for r in cur.fetchall()
+            ]
+    finally:
+        db_put(conn)
+
+def fetch_reparse_batch(after_id: int, limit: int,
+                        skip_version: Optional[str] = None) -> List[Tuple[int, str, Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """
+    Próximo lote (id > after_id) de exames com documento de origem conhecido:
+    [(id, source_fp, data, parsed)]. Com skip_version, pula os já interpretados por ela.
+    """
+    where = "id > %s AND source_fp IS NOT NULL"
+    params: List[Any] = [after_id]
+    if skip_version:
+        where += " AND source_fp NOT LIKE %s"
+        params.append(f"%:{skip_version}")
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT id, source_fp, data::text, parsed::text FROM exams
+                WHERE {where} ORDER BY id LIMIT %s
+            """, (*params, limit))
+            return [(r[0], r[1], json.loads(r[2]), json.loads(r[3]) if r[3] else None)
+                    for r in cur.fetchall()]
+    finally:
+        db_put(conn)
+
+def _apply_reparse_rows(cur, updates: List[ReparseUpdate]) -> Tuple[int, List[int]]:
+    ids = [u[0] for u in updates]
+    cur.execute("""
+        SELECT id, patient_name, sex, age_years, data::text FROM exams
+        WHERE id = ANY(%s) ORDER BY id FOR UPDATE
+    """, (ids,))
+    current = {r[0]: r for r in cur.fetchall()}
+    rows = []
+    deltas = []
+    stale = []
+    for exam_id, seen, data, parsed, source_fp in updates:
+        r = current.get(exam_id)
+        if r is None:
+            continue
+        old = json.loads(r[4])
+        if old != seen:
+            # Editado depois da leitura do lote: a fusão foi feita sobre valores velhos
+            stale.append(exam_id)
+            continue
+        rfp = result_fingerprint(r[1], r[2], r[3], data)
+        rows.append((exam_id, Json(data), Json(parsed), source_fp, rfp))
+        deltas += stats.exam_deltas(r[2], r[3], old, -1) + stats.exam_deltas(r[2], r[3], data, +1)
+    if not rows:
+        return 0, stale
+    execute_values(cur, """
+        UPDATE exams AS e
+        SET data=v.data::jsonb, parsed=v.parsed::jsonb, source_fp=v.source_fp,
+            result_fp=v.result_fp, updated_at=NOW()
+        FROM (VALUES %s) AS v(id, data, parsed, source_fp, result_fp)
+        WHERE e.id = v.id
+    """, rows, page_size=len(rows))
+    _apply_stats_deltas(cur, deltas)
+    return len(rows), stale
+
+def apply_reparse(updates: List[ReparseUpdate]) -> Tuple[int, List[int]]:
+    """
+    Grava [(id, data lida, data nova, parsed, source_fp)] numa única
+    transação, pulando exames editados desde a leitura. Se o lote esbarrar
+    num source_fp já existente, refaz linha a linha. Devolve
+    (gravados, ids em conflito).
+    """
+    if not updates:
+        return 0, []
+    conn = db_conn()
+    try:
+        try:
+            with conn, conn.cursor() as cur:
+                return _apply_reparse_rows(cur, updates)
+        except psycopg2.errors.UniqueViolation:
+            pass
+        done, conflicts = 0, []
+        for u in updates:
+            try:
+                with conn, conn.cursor() as cur:
+                    n, stale = _apply_reparse_rows(cur, [u])
+                done += n
+                conflicts += stale
+            except psycopg2.errors.UniqueViolation:
+                conflicts.append(u[0])
+        return done, conflicts
+    finally:
+        db_put(conn)
+
+def find_exam_by_result_fp(result_fp: str, exclude_id: Optional[int] = None) -> Optional[int]:
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT id FROM exams WHERE result_fp=%s AND id IS DISTINCT FROM %s
+                ORDER BY id LIMIT 1
+            """, (result_fp, exclude_id))
+            row = cur.fetchone()
+            return row[0] if row else None
+    finally:
+        db_put(conn)
+
+def _data_projection(fields: Optional[List[str]]) -> Tuple[str, List[Any]]:
+    """
+    Expressão SQL para a coluna data: o JSONB inteiro ou apenas as chaves
+    pedidas (data -> key), montadas no próprio Postgres.
+    """
+    if not fields:
+        return "data::text", []
+    parts = ", ".join(["%s, data -> %s"] * len(fields))
+    params: List[Any] = []
+    for key in fields:
+        params.extend([key, key])
+    return f"jsonb_strip_nulls(jsonb_build_object({parts}))::text", params
+
+def _exam_row_to_dict(r) -> Dict[str, Any]:
+    return {
+        "id": r[0],
+        "patient_name": r[1],
+        "sex": r[2],
+        "age_years": r[3],
+        "created_at": r[4].isoformat(),
+        "updated_at": r[5].isoformat(),
+        "data": json.loads(r[6]),
+    }
+
+def fetch_exam(exam_id: int, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    expr, params = _data_projection(fields)
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT id, patient_name, sex, age_years, created_at, updated_at, {expr}
+                FROM exams WHERE id=%s
+            """, (*params, exam_id))
+            row = cur.fetchone()
+            return _exam_row_to_dict(row) if row else None
+    finally:
+        db_put(conn)
+
+def fetch_exams(fields: Optional[List[str]] = None, limit: int = 100,
+                before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Lista exames do mais novo para o mais antigo, paginando por id (before_id).
+    """
+    expr, params = _data_projection(fields)
+    where = ""
+    if before_id is not None:
+        where = "WHERE id < %s"
+        params.append(before_id)
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT id, patient_name, sex, age_years, created_at, updated_at, {expr}
+                FROM exams {where} ORDER BY id DESC LIMIT %s
+            """, (*params, limit))
+            return [_exam_row_to_dict(r) for r in cur.fetchall()]
+    finally:
+        db_put(conn)
+
+def get_exam(exam_id: int) -> Optional[Dict[str, Any]]:
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT id, patient_name, sex, age_years, data::text, blob_sha FROM exams WHERE id=%s", (exam_id,))
+            row = cur.fetchone()
+            if not row:
+                return None
+            return {
+                "id": row[0],
+                "patient_name": row[1],
+                "sex": row[2],
+                "age_years": row[3],
+                "data": json.loads(row[4]),
+                "has_source": row[5] is not None,
+            }
+    finally:
+        db_put(conn)
+
+def list_exam_summaries(limit: int, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, patient_name, age_years, created_at, updated_at
+                FROM exams WHERE %s IS NULL OR id < %s ORDER BY id DESC LIMIT %s
+            """, (before_id, before_id, limit))
+            return [
+                {
+                    "id": r[0],
+                    "patient_name": r[1],
+                    "age_years": r[2],
+                    "created_at": r[3].isoformat(),
+                    "updated_at": r[4].isoformat(),
+                } for r in cur.fetchall()
+            ]
+    finally:
+        db_put(conn)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+import hashlib
+import json
+from typing import Any, Dict, Optional
+from .parsing.parse import PARSER_VERSION, normalize_name
+
+def file_sha256(b: bytes) -> str:
+    return hashlib.sha256(b or b"").hexdigest()
+
+def source_fingerprint(b: bytes, parser_version: str = PARSER_VERSION) -> str:
+    """
+    Identifica o documento de origem: hash do arquivo + versão do parser.
+    Reimportar o mesmo arquivo com o mesmo parser gera a mesma impressão digital.
+    """
+    return source_fp_for(file_sha256(b), parser_version)
+
+def source_fp_for(sha: str, parser_version: str = PARSER_VERSION) -> str:
+    return f"{sha}:{parser_version}"
+
+def source_sha(source_fp: Optional[str]) -> Optional[str]:
+    """
+    Hash do arquivo contido em source_fp ('<sha256>:<versão>'); None se não for desse formato.
+    """
+    sha = (source_fp or "").split(":", 1)[0]
+    return sha if len(sha) == 64 else None
+
+def result_fingerprint(patient_name: Optional[str], sex: Optional[str],
+                       age_years: int, data: Dict[str, Any]) -> str:
+    """
+    Identifica o resultado normalizado (paciente, sexo, idade e valores),
+    independente da ordem das chaves e de acentos/caixa no nome.
+    Não identifica o exame (sem data de coleta nem origem): serve só para
+    avisar de possíveis duplicados, nunca para descartar uma gravação.
+    """
+    canon = {
+        "patient_name": normalize_name(patient_name),
+        "sex": (sex or "").upper(),
+        "age_years": int(age_years),
+        "data": {k: (float(v) if isinstance(v, (int, float)) else str(v).strip())
+                 for k, v in sorted((data or {}).items())},
+    }
+    raw = json.dumps(canon, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -1,12 +1,17 @@
 import os
+import tempfile
 import io
+import json
 import datetime as dt
+from bisect import bisect_right
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 from PIL import Image
 import pdfplumber
 from pdf2image import convert_from_bytes
 import pytesseract
 from werkzeug.utils import secure_filename
 from .. import config
+from .parse import parse_lab_text_scored, page_has_results, parsed_has_results, low_confidence
 
 # Aponta tesseract (se necessário no Windows)
 pytesseract.pytesseract.tesseract_cmd = config.TESSERACT_CMD
@@ -26,7 +31,229 @@ def _dump_text_file(txt: str, prefix: str = "pdf", original_name: str | None = N
     except Exception:
         return None
 
-def extract_text_from_image_bytes(b: bytes) -> str:
+def source_text_path(sha: str) -> str:
+    """
+    Texto extraído de um arquivo, endereçado pelo hash do arquivo
+    (TEXT_DUMP_DIR/sources/ab/<sha>.txt). Permite reprocessar sem OCR.
+    """
+    return os.path.join(config.TEXT_DUMP_DIR, "sources", sha[:2], f"{sha}.txt")
+
+def save_source_text(sha: str, txt: str) -> str | None:
+    try:
+        path = source_text_path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Nome temporário único: threads do mesmo processo podem gravar o mesmo sha
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path),
+                                         prefix=f"{sha}.", suffix=".tmp", delete=False) as f:
+            f.write(txt or "")
+        os.replace(f.name, path)
+        return path
+    except Exception:
+        return None
+
+def load_source_text(sha: str) -> str | None:
+    try:
+        with open(source_text_path(sha), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+# ---------- Análise de layout: recorta só as regiões de texto ----------
+
+Box = Tuple[int, int, int, int]
+
+def _runs(profile: List[int], min_val: int, max_gap: int) -> List[Tuple[int, int]]:
+    """
+    Intervalos [ini, fim) onde o perfil passa de min_val, unindo buracos menores que max_gap.
+    """
+    runs: List[Tuple[int, int]] = []
+    start = None
+    last = -1
+    for i, v in enumerate(profile):
+        if v >= min_val:
+            if start is None:
+                start = i
+            elif i - last > max_gap:
+                runs.append((start, last + 1))
+                start = i
+            last = i
+    if start is not None:
+        runs.append((start, last + 1))
+    return runs
+
+def find_text_blocks(img: Image.Image) -> List[Box]:
+    """
+    Blocos de texto por perfis de projeção sobre a imagem binarizada:
+    faixas horizontais com tinta (linhas próximas unidas) e, em cada faixa,
+    as colunas com tinta (corta margens). Faixas densas demais (logos,
+    códigos de barras) são descartadas. Ordem: de cima para baixo.
+
+    Cada bloco é uma faixa inteira da página: não há separação de colunas.
+    Linhas a menos de h/80 umas das outras (uma tabela de resultados, por
+    exemplo) viram um bloco só, e colunas lado a lado ficam na mesma faixa.
+    É de propósito: compact_layout empilha os blocos, e separar a coluna
+    dos rótulos da coluna dos valores quebraria a leitura linha a linha. O
+    ganho vem só dos espaços em branco entre faixas e das margens laterais.
+    """
+    gray = img.convert("L")
+    w, h = gray.size
+    ink = gray.point(lambda p: 255 if p < 160 else 0)
+    # resize com BOX faz a média de cada linha/coluna no próprio PIL (C)
+    rows = list(ink.resize((1, h), Image.BOX).getdata())
+    gap = max(8, h // 80)
+    pad = max(4, h // 400)
+    blocks: List[Box] = []
+    for y0, y1 in _runs(rows, 2, gap):
+        if y1 - y0 < 4:
+            continue
+        band = ink.crop((0, y0, w, y1))
+        cols = list(band.resize((w, 1), Image.BOX).getdata())
+        xs = _runs(cols, 2, w)
+        if not xs:
+            continue
+        x0, x1 = xs[0][0], xs[-1][1]
+        density = sum(cols[x0:x1]) / (255.0 * max(1, x1 - x0))
+        if density > config.OCR_LAYOUT_MAX_INK:
+            continue
+        blocks.append((max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad)))
+    return blocks
+
+def compact_layout(img: Image.Image) -> Tuple[Image.Image, List[Tuple[int, Box]]]:
+    """
+    Empilha os blocos de texto numa imagem menor, na ordem de leitura
+    original, para o Tesseract processar só área útil. Devolve a imagem e os
+    segmentos [(y na imagem compacta, caixa na original)]. Sem ganho relevante
+    (ou sem blocos), devolve a imagem original com um único segmento.
+    """
+    w, h = img.size
+    whole = [(0, (0, 0, w, h))]
+    blocks = find_text_blocks(img)
+    if not blocks:
+        return img, whole
+    sep = 24
+    out_w = max(b[2] - b[0] for b in blocks)
+    out_h = sum(b[3] - b[1] for b in blocks) + sep * (len(blocks) + 1)
+    if out_w * out_h >= 0.9 * w * h:
+        return img, whole
+    fill = 255 if img.mode == "L" else (255, 255, 255)
+    out = Image.new(img.mode, (out_w, out_h), fill)
+    segments: List[Tuple[int, Box]] = []
+    y = sep
+    for b in blocks:
+        out.paste(img.crop(b), (0, y))
+        segments.append((y, b))
+        y += (b[3] - b[1]) + sep
+    return out, segments
+
+def _prepare_for_ocr(img: Image.Image) -> Image.Image:
+    if not config.OCR_LAYOUT_CROP:
+        return img
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return compact_layout(img)[0]
+
+# ---------- OCR por região, com confiança por linha ----------
+
+class OcrLine(NamedTuple):
+    text: str
+    conf: float   # média das palavras com confiança válida (0–100)
+    words: int    # quantas palavras entraram na média
+    top: int      # y do topo da linha na imagem enviada ao Tesseract
+
+# Bloco de texto da página e as linhas lidas nele
+Region = Tuple[Box, List[OcrLine]]
+
+def _ocr_lines(im: Image.Image, psm: int | None = None) -> List[OcrLine]:
+    """
+    OCR via image_to_data, agrupando as palavras em linhas na ordem do Tesseract.
+    """
+    cfg = f"--oem 3 --psm {psm}" if psm else ""
+    d = pytesseract.image_to_data(im, lang=config.OCR_LANGS, config=cfg, output_type=pytesseract.Output.DICT)
+    groups: List[Tuple[List[str], List[float], int]] = []
+    cur_key = None
+    for i, word in enumerate(d["text"]):
+        word = (word or "").strip()
+        if not word:
+            continue
+        key = (d["block_num"][i], d["par_num"][i], d["line_num"][i])
+        if key != cur_key:
+            groups.append(([], [], d["top"][i]))
+            cur_key = key
+        groups[-1][0].append(word)
+        conf = float(d["conf"][i])
+        if conf >= 0:
+            groups[-1][1].append(conf)
+    return [OcrLine(" ".join(ws), (sum(cs) / len(cs)) if cs else 0.0, len(cs), top)
+            for ws, cs, top in groups]
+
+def _mean_conf(lines: List[OcrLine]) -> float:
+    n = sum(ln.words for ln in lines)
+    return sum(ln.conf * ln.words for ln in lines) / n if n else 0.0
+
+def _ocr_regions(img: Image.Image, psm: int | None = None) -> List[Region]:
+    """
+    Um único OCR da imagem compacta (compact_layout) e cada linha devolvida
+    ao bloco de onde veio, pela altura em que o bloco foi colado. Sem
+    OCR_LAYOUT_CROP a página inteira é uma região só.
+    """
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if config.OCR_LAYOUT_CROP:
+        compact, segments = compact_layout(img)
+    else:
+        compact, segments = img, [(0, (0, 0, img.width, img.height))]
+    regions: List[Region] = [(box, []) for _, box in segments]
+    starts = [y for y, _ in segments]
+    for ln in _ocr_lines(compact, psm):
+        regions[max(0, bisect_right(starts, ln.top) - 1)][1].append(ln)
+    return regions
+
+def _regions_text(regions: List[Region]) -> Tuple[str, List[Optional[float]], List[int]]:
+    """
+    Texto das regiões (uma linha de OCR por linha de texto), a confiança de
+    cada linha (alinhada a text.splitlines()) e a região de cada linha.
+    """
+    lines = [(ln, r) for r, (_, lns) in enumerate(regions) for ln in lns]
+    text = "\n".join(ln.text for ln, _ in lines)
+    confs = [ln.conf if ln.words else None for ln, _ in lines]
+    return text, confs, [r for _, r in lines]
+
+def _region_score(lines: List[OcrLine]) -> Tuple[float, float]:
+    text = "\n".join(ln.text for ln in lines)
+    _, fields = parse_lab_text_scored(text, [ln.conf if ln.words else None for ln in lines])
+    return sum(f["confidence"] for f in fields.values()), _mean_conf(lines)
+
+def _weak_regions(regions: List[Region], fields: Dict[str, Dict[str, Any]], owner: List[int]) -> List[int]:
+    """
+    Regiões que merecem novo OCR: confiança média das palavras abaixo de
+    OCR_MIN_CONF ou que contêm o rótulo ou o valor de um analito com
+    confiança abaixo de PARSE_MIN_CONF. Blocos sem nenhuma palavra lida
+    (traços, carimbos) só entram pelo segundo critério.
+    """
+    weak = {r for r, (_, lns) in enumerate(regions)
+            if any(ln.words for ln in lns) and _mean_conf(lns) < config.OCR_MIN_CONF}
+    for key in low_confidence(fields, config.PARSE_MIN_CONF):
+        f = fields[key]
+        weak.update(owner[n - 1] for n in (f["line"], f["label_line"]) if n - 1 < len(owner))
+    return sorted(weak)
+
+def _retry_regions(regions: List[Region], weak: List[int],
+                   crop: Callable[[Box], Image.Image], psm: int | None = None) -> int:
+    """
+    Refaz o OCR só dos recortes das regiões fracas e fica com a leitura que
+    rende mais (confiança somada dos analitos, depois confiança das palavras).
+    Retorna quantas regiões foram trocadas.
+    """
+    replaced = 0
+    for r in weak:
+        box, old = regions[r]
+        new = _ocr_lines(crop(box), psm)
+        if _region_score(new) > _region_score(old):
+            regions[r] = (box, new)
+            replaced += 1
+    return replaced
+
+def _image_text_and_confs(b: bytes) -> Tuple[str, List[Optional[float]]]:
     img = Image.open(io.BytesIO(b))
     if img.mode not in ("RGB", "L"):
         img = img.convert("RGB")
@@ -35,46 +262,223 @@ def extract_text_from_image_bytes(b: bytes) -> str:
         img = img.resize((w*2, h*2), Image.LANCZOS)
     gray = img.convert("L")
     bw = gray.point(lambda p: 255 if p > 200 else (0 if p < 140 else p))
-    config_str = "--oem 3 --psm 6"
     try:
-        txt = pytesseract.image_to_string(bw, lang=config.OCR_LANGS, config=config_str)
-        if len((txt or "").strip()) < 40:
-            txt = pytesseract.image_to_string(bw, lang=config.OCR_LANGS, config="--oem 3 --psm 4")
+        # psm 6 na imagem toda; psm 4 (colunas) só nos blocos fracos
+        regions = _ocr_regions(bw, 6)
+        txt, confs, owner = _regions_text(regions)
+        _, fields = parse_lab_text_scored(txt, confs)
+        weak = _weak_regions(regions, fields, owner)
+        if weak and _retry_regions(regions, weak, bw.crop, 4):
+            txt, confs, _ = _regions_text(regions)
     except Exception:
-        txt = pytesseract.image_to_string(bw, lang=config.OCR_LANGS)
-    return txt or ""
+        txt = pytesseract.image_to_string(bw, lang=config.OCR_LANGS) or ""
+        confs = [None] * len(txt.splitlines())
+    return txt, confs
 
-def extract_text_from_pdf_bytes(b: bytes, src_name: str | None = None) -> str:
-    text_pages = []
+def extract_text_from_image_bytes(b: bytes) -> str:
+    return _image_text_and_confs(b)[0]
+
+# ---------- OCR adaptativo por página ----------
+
+def _escalation_log_path() -> str:
+    return os.path.join(config.TEXT_DUMP_DIR, "ocr-escalations.jsonl")
+
+def _record_page(entry: Dict[str, Any]) -> None:
+    """
+    Registra o resultado de cada página (uma linha JSON) para calibrar
+    OCR_MIN_CONF/OCR_MIN_ANALYTES. Funciona também a partir do pool de processos.
+    """
+    try:
+        os.makedirs(config.TEXT_DUMP_DIR, exist_ok=True)
+        entry = {"at": dt.datetime.now().isoformat(timespec="seconds"), **entry}
+        with open(_escalation_log_path(), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except Exception:
+        pass
+
+def escalation_summary() -> Dict[str, Any]:
+    """
+    Taxa de reprocessamento em alta resolução, por motivo.
+    """
+    pages = escalated = 0
+    reasons: Dict[str, int] = {}
+    try:
+        with open(_escalation_log_path(), "r", encoding="utf-8") as f:
+            for line in f:
+                e = json.loads(line)
+                pages += 1
+                if e.get("escalated"):
+                    escalated += 1
+                    reasons[e.get("reason") or "?"] = reasons.get(e.get("reason") or "?", 0) + 1
+    except FileNotFoundError:
+        pass
+    return {
+        "pages": pages,
+        "escalated": escalated,
+        "rate": (escalated / pages) if pages else None,
+        "reasons": reasons,
+    }
+
+def _render_page(b: bytes, page_no: int, dpi: int) -> Image.Image:
+    kwargs = {"dpi": dpi, "first_page": page_no, "last_page": page_no}
+    if config.POPPLER_PATH:
+        kwargs["poppler_path"] = config.POPPLER_PATH
+    return convert_from_bytes(b, **kwargs)[0]
+
+def _ocr_pdf_page_adaptive(b: bytes, page_no: int, src_name: str | None
+                           ) -> Tuple[str, List[Optional[float]], bool]:
+    """
+    OCR de uma página: a passada em baixa resolução também classifica a
+    página. Só as regiões fracas (_weak_regions) são relidas, recortadas da
+    página renderizada em alta resolução; com resultados mas sem analitos
+    suficientes, relê todas. Sem rótulos de resultado (e com confiança boa)
+    a página é descartada. Retorna (texto, confiança por linha, tem resultados?).
+    """
+    regions = _ocr_regions(_render_page(b, page_no, config.OCR_LOW_DPI))
+    txt, confs, owner = _regions_text(regions)
+    conf = _mean_conf([ln for _, lns in regions for ln in lns])
+    form, fields = parse_lab_text_scored(txt, confs)
+    has_results = parsed_has_results(form, fields)
+    n = len(fields)
+    weak = _weak_regions(regions, fields, owner)
+    reason = None
+    if conf < config.OCR_MIN_CONF:
+        reason = "conf"
+    elif has_results and n < config.OCR_MIN_ANALYTES:
+        reason = "analytes"
+        weak = list(range(len(regions)))
+    elif has_results and weak:
+        reason = "regions"
+    else:
+        weak = []
+    entry = {"file": src_name, "page": page_no, "dpi": config.OCR_LOW_DPI,
+             "conf": round(conf, 1), "analytes": n, "escalated": bool(weak), "reason": reason,
+             "regions": len(regions), "retried": len(weak)}
+    if weak:
+        hi = _render_page(b, page_no, config.OCR_HIGH_DPI)
+        if hi.mode not in ("RGB", "L"):
+            hi = hi.convert("RGB")
+        k = config.OCR_HIGH_DPI / config.OCR_LOW_DPI
+        replaced = _retry_regions(regions, weak, lambda box: hi.crop(tuple(round(v * k) for v in box)), 6)
+        entry["replaced"] = replaced
+        if replaced:
+            txt, confs, _ = _regions_text(regions)
+            form, fields = parse_lab_text_scored(txt, confs)
+            has_results = parsed_has_results(form, fields)
+            entry.update({"conf_hi": round(_mean_conf([ln for _, lns in regions for ln in lns]), 1),
+                          "analytes_hi": len(fields)})
+    entry["skipped"] = not has_results
+    _record_page(entry)
+    return txt, confs, has_results
+
+def _ocr_pdf_page(b: bytes, page_no: int, src_name: str | None) -> Tuple[str, List[Optional[float]], bool]:
+    if config.OCR_ADAPTIVE:
+        return _ocr_pdf_page_adaptive(b, page_no, src_name)
+    im = _prepare_for_ocr(_render_page(b, page_no, config.OCR_HIGH_DPI))
+    txt = pytesseract.image_to_string(im, lang=config.OCR_LANGS)
+    return txt, [None] * len(txt.splitlines()), page_has_results(txt)
+
+# Linhas finais de uma página pulada que ainda podem ser rótulo de um valor
+# que só aparece no topo da página seguinte
+_CARRY_LINES = 3
+
+def _with_carry(carry: List[Tuple[str, Optional[float]]], t: str, confs: List[Optional[float]]
+                ) -> Optional[Tuple[str, List[Optional[float]]]]:
+    """
+    Texto da página precedido do final da página anterior (pulada), se isso
+    faz o parser ler mais analitos do que a página sozinha.
+    """
+    if not carry:
+        return None
+    text = "\n".join([ln for ln, _ in carry] + [t])
+    both = [c for _, c in carry] + confs
+    if len(parse_lab_text_scored(text, both)[1]) > len(parse_lab_text_scored(t, confs)[1]):
+        return text, both
+    return None
+
+def iter_pdf_pages(b: bytes, src_name: str | None = None
+                   ) -> Iterator[Tuple[int, str, str, List[Optional[float]]]]:
+    """
+    Gera (nº da página, texto, método, confiança OCR por linha — None na
+    camada de texto) só das páginas com resultados, uma por
+    vez: camada de texto quando existe, OCR (rasterizando só aquela página)
+    quando a página é imagem (pouco texto e alguma imagem). Páginas em
+    branco ou quase vazias sem imagem não são rasterizadas. Páginas sem
+    resultados (métodos, referências, assinaturas) são puladas, mas as
+    últimas linhas delas vão junto com a página seguinte quando completam
+    um analito (rótulo no pé da página, valor na próxima). Com
+    PDF_STOP_AFTER_EMPTY > 0, depois de achar resultados, essa quantidade de
+    páginas vazias seguidas encerra o documento sem rasterizar o restante.
+    """
+    seen_results = False
+    empty_run = 0
+    carry: List[Tuple[str, Optional[float]]] = []
     with pdfplumber.open(io.BytesIO(b)) as pdf:
-        for pg in pdf.pages:
+        for page_no, pg in enumerate(pdf.pages, start=1):
             t = pg.extract_text() or ""
-            text_pages.append(t)
-    joined = "\n".join(text_pages).strip()
-    method = "pdfplumber"
-
-    if len(joined) < 100:
-        kwargs = {"dpi": 300}
-        if config.POPPLER_PATH:
-            kwargs["poppler_path"] = config.POPPLER_PATH
-        imgs = convert_from_bytes(b, **kwargs)
-        ocr_txt = []
-        for im in imgs:
-            ocr_txt.append(pytesseract.image_to_string(im, lang=config.OCR_LANGS))
-        joined = "\n".join(ocr_txt)
-        method = "ocr"
-
-    _dump_text_file(joined, prefix=f"pdftext-{method}", original_name=src_name)
-    return joined or ""
+            if len(t.strip()) >= config.PDF_PAGE_MIN_TEXT or not pg.images:
+                method = "pdfplumber"
+                confs = [None] * len(t.splitlines())
+                has_results = page_has_results(t)
+            else:
+                method = "ocr"
+                t, confs, has_results = _ocr_pdf_page(b, page_no, src_name)
+            joined = _with_carry(carry, t, confs)
+            if joined:
+                t, confs = joined
+                has_results = True
+            if has_results:
+                seen_results = True
+                empty_run = 0
+                carry = []
+                yield page_no, t, method, confs
+                continue
+            carry = [lc for lc in zip(t.splitlines(), confs) if lc[0].strip()][-_CARRY_LINES:]
+            empty_run += 1
+            if seen_results and config.PDF_STOP_AFTER_EMPTY and empty_run >= config.PDF_STOP_AFTER_EMPTY:
+                return
+
+def _pdf_text_and_confs(b: bytes, src_name: str | None = None) -> Tuple[str, List[Optional[float]]]:
+    pages = list(iter_pdf_pages(b, src_name))
+    lines: List[Tuple[str, Optional[float]]] = []
+    for _, t, _, confs in pages:
+        lines.extend(zip(t.splitlines(), confs))
+    # sem linhas em branco nas pontas (equivale ao strip do texto unido)
+    while lines and not lines[0][0].strip():
+        lines.pop(0)
+    while lines and not lines[-1][0].strip():
+        lines.pop()
+    joined = "\n".join(ln for ln, _ in lines)
+    methods = sorted({m for _, _, m, _ in pages}) or ["vazio"]
+    _dump_text_file(joined, prefix=f"pdftext-{'+'.join(methods)}", original_name=src_name)
+    return joined, [c for _, c in lines]
+
+def extract_text_from_pdf_bytes(b: bytes, src_name: str | None = None) -> str:
+    return _pdf_text_and_confs(b, src_name)[0]
 
 def extract_text_from_upload(file_storage) -> str:
-    filename = secure_filename(file_storage.filename or "")
-    ext = "." + filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
     data = file_storage.read()
     file_storage.stream.seek(0)
+    return extract_text_from_bytes(data, file_storage.filename)
+
+def extract_text_from_bytes(data: bytes, filename: str | None) -> str:
+    """
+    Mesmo que extract_text_from_upload, mas a partir dos bytes (serializável,
+    pode rodar em outro processo).
+    """
+    return extract_text_and_confs_from_bytes(data, filename)[0]
+
+def extract_text_and_confs_from_bytes(data: bytes, filename: str | None) -> Tuple[str, List[Optional[float]]]:
+    """
+    Texto e, alinhada a text.splitlines(), a confiança média do OCR de cada
+    linha (None onde o texto veio da camada de texto do PDF). Alimenta
+    parse_lab_text_scored.
+    """
+    filename = secure_filename(filename or "")
+    ext = "." + filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
     if ext == ".pdf":
-        return extract_text_from_pdf_bytes(data, filename)
+        return _pdf_text_and_confs(data, filename)
     elif ext in {".png", ".jpg", ".jpeg"}:
-        return extract_text_from_image_bytes(data)
+        return _image_text_and_confs(data)
     else:
         raise ValueError("Formato não suportado. Envie PDF/JPG/PNG.")
@@ -1,7 +1,12 @@
 import re
-from typing import Dict
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
 import unicodedata
 
+# Versão do parser: incrementar sempre que a extração mudar (entra na
+# impressão digital da fonte, ver app/fingerprints.py)
+PARSER_VERSION = "2"
+
 # ---------- Normalização de texto/número/unidade ----------
 
 def _normalize_text(s: str) -> str:
@@ -9,27 +14,33 @@ def _normalize_text(s: str) -> str:
     s = "".join(c for c in s if not unicodedata.combining(c))
     return s.lower()
 
-def _has_digit(s: str) -> bool:
-    return bool(re.search(r"\d", s or ""))
-
-def _truncate_at_ref_meta_tail(s: str) -> str:
+def normalize_name(s: str | None) -> str:
     """
-    Corta o texto no início de blocos de referência/metadados comuns.
+    Nome de paciente sem acentos, minúsculo, só letras/dígitos e espaços simples.
     """
-    pats = [
-        r"valores\s+de\s+refer", r"intervalo\s+de\s+refer",
-        r"\bcoleta\b", r"\bcoletad?o?\b", r"\bhoras?\b",
-        r"\bmaterial\b", r"\bm[ée]todo\b", r"\bsistema\s+automatico\b",
-        r"\bparametros\b", r"\bfase\b", r"\bpos[-\s]?menopausa\b",
-        r"\bgestantes?\b",
-    ]
-    cut = len(s or "")
-    for p in pats:
-        m = re.search(p, s or "", flags=re.I)
-        if m:
-            cut = min(cut, m.start())
-    return (s or "")[:cut]
+    t = re.sub(r"[^a-z0-9]+", " ", _normalize_text(s or ""))
+    return " ".join(t.split())
+
+_DIGIT = re.compile(r"\d")
+
+def _has_digit(s: str) -> bool:
+    return bool(_DIGIT.search(s or ""))
 
+# Início de blocos de referência/metadados; uma única alternância compilada:
+# o primeiro match é o menor início entre todos os padrões.
+_REF_META_TAIL = re.compile("|".join([
+    r"valores\s+de\s+refer", r"intervalo\s+de\s+refer",
+    r"\bcoleta\b", r"\bcoletad?o?\b", r"\bhoras?\b",
+    r"\bmaterial\b", r"\bm[ée]todo\b", r"\bsistema\s+automatico\b",
+    r"\bparametros\b", r"\bfase\b", r"\bpos[-\s]?menopausa\b",
+    r"\bgestantes?\b",
+]), re.I)
+
+def _ref_meta_cut(s: str) -> int:
+    m = _REF_META_TAIL.search(s or "")
+    return m.start() if m else len(s or "")
+
+@lru_cache(maxsize=256)
 def _norm_unit(u: str | None) -> str | None:
     if not u:
         return None
@@ -76,16 +87,49 @@ _NUM_WITH_UNIT = re.compile(
         (?P<num>\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)?|\d+(?:[.,]\d+)?)
         \s*(?P<unit>
             %|
-            g/?d[il]l|mg/?d[il]l|ug/?d[il]l|
-            m?ui/?/?ml|u/?ml|ng/?ml|pg/?ml|
+            g/?d[il]?l|mg/?d[il]?l|ug/?d[il]?l|ng/?d[il]?l|
+            m?ui/?/?ml|u/?ml|u/l|ng/?ml|pg/?ml|
             /mm3|10\^6/?mm3|fl|pg|nmol/l
         )?
     """,
     re.I | re.X
 )
 
+_INTERVAL_SEP = re.compile(r"\b(a|ate|até|–|-)\b", re.I)
+
 def _looks_interval(after: str) -> bool:
-    return bool(after and re.search(r"\b(a|ate|até|–|-)\b", after, flags=re.I) and _NUM_WITH_UNIT.search(after))
+    return bool(after and _INTERVAL_SEP.search(after) and _NUM_WITH_UNIT.search(after))
+
+class _NumToken(NamedTuple):
+    pos: int
+    val: Optional[float]
+    op: Optional[str]
+    unit: Optional[str]
+    interval: bool
+
+class _LineTokens(NamedTuple):
+    cut: int
+    nums: Tuple[_NumToken, ...]
+
+@lru_cache(maxsize=8192)
+def _tokenize(s: str) -> _LineTokens:
+    """
+    Tokeniza uma linha uma única vez: posição do corte de referência/metadados
+    e, antes dele, números com operador, unidade normalizada e marca de
+    intervalo ("x a y"). O cache é compartilhado entre analitos e documentos.
+    """
+    cut = _ref_meta_cut(s)
+    t = s[:cut]
+    nums = []
+    for m in _NUM_WITH_UNIT.finditer(t):
+        nums.append(_NumToken(
+            pos=m.start(),
+            val=_normalize_number(m.group("num")),
+            op=m.group("op") or None,
+            unit=_norm_unit(m.group("unit")),
+            interval=_looks_interval(t[m.end(): m.end()+40]),
+        ))
+    return _LineTokens(cut, tuple(nums))
 
 # ---------- Hints de unidade por analito ----------
 
@@ -112,6 +156,8 @@ UNIT_HINTS = {
     "HBA1C": ["%"],
 }
 
+_UNIT_HINTS_NORM = {k: [u and _norm_unit(u) for u in v] for k, v in UNIT_HINTS.items()}
+
 # ---------- Sinônimos por analito (para encontrar rótulos no laudo) ----------
 
 ANALYTE_SYNONYMS = {
@@ -218,6 +264,25 @@ def _to_fuzzy_regex(token: str) -> str:
     parts = [re.escape(ch) for ch in t]
     return r"\b" + r"[\s\W_]*".join(parts) + r"\b"
 
+def _readable_synonym(synonym: str, label: str) -> str:
+    """
+    Sinônimo para exibição: regex de ANALYTE_SYNONYMS vira o trecho lido.
+    """
+    return label.strip() if _looks_like_regex(synonym) else synonym
+
+@lru_cache(maxsize=1)
+def _compiled_synonyms() -> Dict[str, list]:
+    compiled = {}
+    for key, names in ANALYTE_SYNONYMS.items():
+        pats = []
+        for nm in names:
+            pat = nm if _looks_like_regex(nm) else _to_fuzzy_regex(nm)
+            pats.append(re.compile(pat, re.I))
+        compiled[key] = pats
+    return compiled
+
+_INTERVAL_IN_LINE = re.compile(r"\d[\d\.,]*\s*(a|ate|até|–|-)\s*\d")
+
 def _is_reference_or_meta_line(s: str) -> bool:
     t = _normalize_text(s or "")
     gatilhos = [
@@ -230,43 +295,79 @@ def _is_reference_or_meta_line(s: str) -> bool:
     ]
     if any(g in t for g in gatilhos):
         return True
-    if re.search(r"\d[\d\.,]*\s*(a|ate|até|–|-)\s*\d", t):
+    if _INTERVAL_IN_LINE.search(t):
         return True
     return False
 
-def _extract_value_for_key(s: str, key: str):
+def page_has_results(text: str) -> bool:
     """
-    1) Corta referência/metadados.
-    2) Varre números+unidades, ignora intervalos "x a y".
-    3) Prefere unidade coerente (UNIT_HINTS) e pega o 1º candidato remanescente.
+    Classificador de página pelo próprio parser: algum analito lido (na
+    linha do rótulo ou abaixo dela) ou o cabeçalho do paciente. Páginas de
+    métodos e assinaturas dão False.
     """
-    s = _truncate_at_ref_meta_tail(s or "")
-    if not s:
-        return None, None
-
-    cands = []
-    for m in _NUM_WITH_UNIT.finditer(s):
-        after = s[m.end(): m.end()+40]
-        if _looks_interval(after):
-            continue
-        op = (m.group("op") or None)
-        val = _normalize_number(m.group("num"))
-        if val is None:
-            continue
-        unit = _norm_unit(m.group("unit"))
-        cands.append({"val": val, "op": op, "unit": unit, "pos": m.start()})
+    return parsed_has_results(*parse_lab_text_scored(text))
 
+def parsed_has_results(form: Dict[str, Any], fields: Dict[str, Dict[str, Any]]) -> bool:
+    """
+    page_has_results sobre uma saída de parse_lab_text_scored já calculada.
+    """
+    return bool(fields) or "_patient_name" in form or "_age_years" in form
+
+def _select_token(tokens: _LineTokens, key: str) -> Optional[_NumToken]:
+    cands = [t for t in tokens.nums if not t.interval and t.val is not None]
     if not cands:
-        return None, None
+        return None
 
-    hints = [u and _norm_unit(u) for u in UNIT_HINTS.get(key, [])]
+    hints = _UNIT_HINTS_NORM.get(key, [])
     if hints:
-        prefer = [c for c in cands if (c["unit"] in hints) or (c["unit"] is None and None in hints)]
+        prefer = [c for c in cands if _unit_agrees(c, hints)]
         if prefer:
             cands = prefer
 
-    best = sorted(cands, key=lambda c: c["pos"])[0]
-    return best["val"], best["op"]
+    return cands[0]
+
+def _unit_agrees(tok: _NumToken, hints: list) -> bool:
+    return (tok.unit in hints) or (tok.unit is None and None in hints)
+
+# ---------- Confiança por analito ----------
+
+# Fatores (0–1) multiplicados para formar a confiança de cada valor extraído.
+_CONF_LOOKAHEAD = 0.8        # valor veio de uma linha abaixo do rótulo
+_CONF_LOOKAHEAD_HOP = 0.05   # por linha a mais até achar o valor
+_CONF_SHORT_LABEL = 0.85     # rótulo de até 3 letras (sigla) casa por acaso mais fácil
+_CONF_NO_HINT = 0.9          # analito sem unidade esperada em UNIT_HINTS
+_CONF_UNIT_MISSING = 0.85    # unidade esperada, mas o número veio sem nenhuma
+_CONF_UNIT_MISMATCH = 0.6    # número com unidade diferente da esperada
+
+def _score(key: str, tok: _NumToken, label: str, hops: int,
+           ocr_conf: Optional[float]) -> Tuple[float, Optional[bool]]:
+    """
+    Confiança (0–1) de um valor e concordância da unidade (None se o analito
+    não tem unidade esperada).
+    """
+    c = 1.0
+    if hops:
+        c *= _CONF_LOOKAHEAD - _CONF_LOOKAHEAD_HOP * (hops - 1)
+    if len(re.sub(r"[^a-z0-9]", "", label)) <= 3:
+        c *= _CONF_SHORT_LABEL
+    hints = _UNIT_HINTS_NORM.get(key)
+    unit_ok = None
+    if not hints:
+        c *= _CONF_NO_HINT
+    else:
+        unit_ok = _unit_agrees(tok, hints)
+        if not unit_ok:
+            c *= _CONF_UNIT_MISSING if tok.unit is None else _CONF_UNIT_MISMATCH
+    if ocr_conf is not None:
+        c *= max(0.0, min(100.0, ocr_conf)) / 100.0
+    return c, unit_ok
+
+def low_confidence(fields: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """
+    Analitos cuja confiança ficou abaixo de threshold, do menos confiável ao mais.
+    """
+    weak = [k for k, f in fields.items() if f["confidence"] < threshold]
+    return sorted(weak, key=lambda k: fields[k]["confidence"])
 
 def parse_lab_text_to_form(text: str) -> Dict[str, float]:
     """
@@ -275,52 +376,89 @@ def parse_lab_text_to_form(text: str) -> Dict[str, float]:
     - Se não achar, olha até 6 linhas à frente (pulando referências/metadados).
     - Guarda operador (ex.: '<', '>') em {key}__op quando existir (auxiliar, se precisar).
     - Extrai meta simples: _patient_name e _age_years, quando presentes.
+    Confiança e origem de cada valor: parse_lab_text_scored.
+    """
+    return parse_lab_text_scored(text)[0]
+
+def parse_lab_text_scored(text: str, line_confs: Optional[Sequence[Optional[float]]] = None
+                          ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Mesmo resultado de parse_lab_text_to_form, mais {key: detalhes} com a
+    confiança (0–1) e a origem de cada valor: linha do valor e do rótulo
+    (1 = primeira de text.splitlines()), sinônimo casado (o rótulo lido,
+    quando o sinônimo é uma regex), se veio de linhas
+    abaixo do rótulo (lookahead), unidade lida e se confere com UNIT_HINTS.
+    line_confs, quando vem de OCR, é a confiança média (0–100) das palavras
+    de cada linha de text.splitlines(); entra como ocr_conf e na confiança.
     """
     tnorm = _normalize_text(text or "")
-    lines = [ln.strip() for ln in tnorm.splitlines() if ln.strip()]
-    form: Dict[str, float] = {}
+    raw = tnorm.splitlines()
+    line_no = [n for n, ln in enumerate(raw) if ln.strip()]
+    lines = [raw[n].strip() for n in line_no]
+    form: Dict[str, Any] = {}
+    fields: Dict[str, Dict[str, Any]] = {}
 
-    compiled = {}
-    for key, names in ANALYTE_SYNONYMS.items():
-        pats = []
-        for nm in names:
-            pat = nm if _looks_like_regex(nm) else _to_fuzzy_regex(nm)
-            pats.append(re.compile(pat, re.I))
-        compiled[key] = pats
+    def ocr_conf(*idx: int) -> Optional[float]:
+        if not line_confs:
+            return None
+        cs = [line_confs[line_no[k]] for k in idx
+              if line_no[k] < len(line_confs) and line_confs[line_no[k]] is not None]
+        return min(cs) if cs else None
+
+    # Classificação e tokens de cada linha calculados uma vez por documento,
+    # não uma vez por analito que olha à frente.
+    skip = [_is_reference_or_meta_line(ln) or not _has_digit(ln) for ln in lines]
+    tokens = [None] * len(lines)
 
     for i, ln in enumerate(lines):
-        for key, pats in compiled.items():
+        for key, pats in _compiled_synonyms().items():
             if key in form:
                 continue
-            for pat in pats:
+            for n, pat in enumerate(pats):
                 m = pat.search(ln)
                 if not m:
                     continue
                 tail = ln[m.end():].strip()
-                val = op = None
+                tok = None
+                j = i
                 if _has_digit(tail):
                     colon = tail.find(":")
                     if 0 <= colon <= 40:
                         tail = tail[colon + 1:].strip()
-                    tail = _truncate_at_ref_meta_tail(tail)
-                    val, op = _extract_value_for_key(tail, key)
+                    tok = _select_token(_tokenize(tail), key)
 
-                if val is None:
+                if tok is None:
                     hop = 0
                     while (i + 1 + hop) < len(lines) and hop < 6:
-                        cand = lines[i + 1 + hop]
+                        j = i + 1 + hop
                         hop += 1
-                        if _is_reference_or_meta_line(cand) or not _has_digit(cand):
+                        if skip[j]:
                             continue
-                        v2, op2 = _extract_value_for_key(cand, key)
-                        if v2 is not None:
-                            val, op = v2, op2
+                        if tokens[j] is None:
+                            tokens[j] = _tokenize(lines[j])
+                        tok = _select_token(tokens[j], key)
+                        if tok is not None:
                             break
 
-                if val is not None:
-                    form[key] = val
-                    if op:
-                        form[f"{key}__op"] = op
+                if tok is not None:
+                    form[key] = tok.val
+                    if tok.op:
+                        form[f"{key}__op"] = tok.op
+                    oc = ocr_conf(i, j)
+                    conf, unit_ok = _score(key, tok, m.group(0), j - i, oc)
+                    fields[key] = {
+                        "value": tok.val,
+                        "op": tok.op,
+                        "confidence": round(conf, 3),
+                        "line": line_no[j] + 1,
+                        "label_line": line_no[i] + 1,
+                        "synonym": _readable_synonym(ANALYTE_SYNONYMS[key][n], m.group(0)),
+                        "label": m.group(0),
+                        "lookahead": j != i,
+                        "unit": tok.unit,
+                        "unit_ok": unit_ok,
+                        "ocr_conf": None if oc is None else round(oc, 1),
+                    }
                     break
 
     # Metadados simples (paciente / idade)
@@ -331,4 +469,4 @@ def parse_lab_text_to_form(text: str) -> Dict[str, float]:
     if m_age:
         form["_age_years"] = int(m_age.group(1))
 
-    return form
+    return form, fields
@@ -0,0 +1,129 @@
+from __future__ import annotations
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .constants import FIELD_KEYS
+from .storage import get_repo
+from .fingerprints import source_fp_for, source_sha
+from .parsing.ocr import load_source_text
+from .parsing.parse import PARSER_VERSION, parse_lab_text_to_form
+
+# Reprocessamento em lote dos textos já extraídos (TEXT_DUMP_DIR/sources),
+# sem refazer OCR: reinterpreta com o parser atual, compara com exams.data e
+# grava as diferenças (--apply) ou só gera relatório. Retoma de um checkpoint.
+# exams.parsed guarda a leitura anterior do parser: só valores que ainda são
+# iguais a ela são trocados; os corrigidos à mão vão para o relatório.
+
+def parse_source(sha: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Analitos que o parser atual lê no texto guardado do documento,
+    ou None se o texto não existe.
+    """
+    text = load_source_text(sha) if sha else None
+    if text is None:
+        return None
+    parsed = parse_lab_text_to_form(text)
+    return {k: v for k, v in parsed.items() if k in FIELD_KEYS}
+
+def _reparse_one(item: Tuple[int, str]) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    Roda no pool de processos: lê o texto guardado e reinterpreta.
+    Retorna (id, {analito: valor}) ou (id, None) se o texto não existe.
+    """
+    exam_id, sha = item
+    return exam_id, parse_source(sha)
+
+def diff_data(old: Dict[str, Any], base: Optional[Dict[str, Any]],
+              new: Dict[str, Any]) -> Tuple[Dict[str, List[Any]], Dict[str, List[Any]]]:
+    """
+    Analitos cujo valor mudou ou surgiu, {analito: [atual, novo]}, em dois
+    grupos: (aplicáveis, manuais). Aplicável é o valor que ainda é o da
+    leitura anterior (base); sem base, só o analito ausente. Os demais
+    foram corrigidos à mão e não são sobrescritos. Analitos que o parser
+    não encontrou são mantidos como estão.
+    """
+    base = base or {}
+    apply: Dict[str, List[Any]] = {}
+    manual: Dict[str, List[Any]] = {}
+    for k, v in new.items():
+        cur = old.get(k)
+        if cur == v:
+            continue
+        (apply if cur == base.get(k) else manual)[k] = [cur, v]
+    return apply, manual
+
+def _read_checkpoint(path: Optional[str]) -> int:
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        ck = json.load(f)
+    if ck.get("parser_version") != PARSER_VERSION:
+        return 0
+    return int(ck.get("last_id", 0))
+
+def _write_checkpoint(path: Optional[str], last_id: int, totals: Dict[str, int]) -> None:
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"last_id": last_id, "parser_version": PARSER_VERSION, **totals}, f)
+    os.replace(tmp, path)
+
+def _batches(after_id: int, batch: int, include_current: bool) -> Iterator[List[Tuple[int, str, Dict[str, Any]]]]:
+    while True:
+        rows = get_repo().fetch_reparse_batch(after_id, batch, None if include_current else PARSER_VERSION)
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+def run(apply: bool = False, workers: int = 0, batch: int = 500,
+        checkpoint: Optional[str] = None, report: Optional[str] = None,
+        include_current: bool = False) -> Dict[str, int]:
+    """
+    Percorre os exames em lotes por id. Cada lote é interpretado em paralelo
+    e, com apply, gravado numa única transação antes do checkpoint avançar.
+    """
+    totals = {"seen": 0, "missing_text": 0, "changed": 0, "manual": 0, "written": 0, "conflicts": 0}
+    after_id = _read_checkpoint(checkpoint)
+    out = open(report, "a", encoding="utf-8") if report else None
+    pool = ProcessPoolExecutor(max_workers=workers or None)
+    try:
+        for rows in _batches(after_id, batch, include_current):
+            by_id = {r[0]: r for r in rows}
+            jobs = [(r[0], source_sha(r[1])) for r in rows if source_sha(r[1])]
+            updates = []
+            for exam_id, parsed in pool.map(_reparse_one, jobs, chunksize=max(1, len(jobs) // 32)):
+                totals["seen"] += 1
+                _, sfp, old, base = by_id[exam_id]
+                if parsed is None:
+                    totals["missing_text"] += 1
+                    continue
+                changes, manual = diff_data(old, base, parsed)
+                new_fp = source_fp_for(source_sha(sfp))
+                if changes:
+                    totals["changed"] += 1
+                if manual:
+                    totals["manual"] += 1
+                if out and (changes or manual):
+                    out.write(json.dumps({"id": exam_id, "changes": changes, "manual": manual},
+                                         ensure_ascii=False) + "\n")
+                if apply and (changes or new_fp != sfp or parsed != base):
+                    data = {**old, **{k: v for k, (_, v) in changes.items()}}
+                    updates.append((exam_id, old, data, parsed, new_fp))
+            if apply:
+                written, conflicts = get_repo().apply_reparse(updates)
+                totals["written"] += written
+                totals["conflicts"] += len(conflicts)
+                if out:
+                    for exam_id in conflicts:
+                        out.write(json.dumps({"id": exam_id, "conflict": True}) + "\n")
+            if out:
+                out.flush()
+            _write_checkpoint(checkpoint, rows[-1][0], totals)
+    finally:
+        pool.shutdown()
+        if out:
+            out.close()
+    return totals
@@ -1,29 +1,68 @@
 from __future__ import annotations
 import json
-from typing import Dict, Any, Optional
-from flask import Flask, request, redirect, url_for, render_template, flash, jsonify
+import math
+import re
+import click
+from typing import Dict, Any, List, Optional, Tuple
+from flask import Flask, request, redirect, url_for, render_template, flash, jsonify, send_file, abort
 from . import config
-from .db import db_conn, db_put, get_pool, find_ref
-from .constants import FIELDS, EXPLAINS
-from .parsing.ocr import extract_text_from_upload
-from .parsing.parse import parse_lab_text_to_form
-from psycopg2.extras import Json
+from .storage import get_repo, DuplicateExamError
+from . import blobstore
+from . import stats, reparse
+from .fingerprints import file_sha256, source_fp_for, source_sha, result_fingerprint
+from .constants import FIELDS, FIELD_KEYS, EXPLAINS
+from .workers import run_cpu, ocr_and_parse
+from .parsing.ocr import escalation_summary
+from .parsing.parse import low_confidence
+from werkzeug.utils import secure_filename
 
 app = Flask(__name__, template_folder="templates", static_folder=None)
 app.secret_key = config.SECRET_KEY
+app.config["USE_X_SENDFILE"] = config.BLOB_X_SENDFILE
+
+repo = get_repo()
+
+_SOURCE_FP_RE = re.compile(r"[0-9a-f]{64}:[\w.\-]{1,32}")
 
 # -------- helpers --------
 
-def render_form(form: Dict[str, Any], exam_id: Optional[int]):
+def render_form(form: Dict[str, Any], exam_id: Optional[int], check: Optional[Dict[str, float]] = None):
     return render_template(
         "form.html",
         title=config.APP_TITLE,
         APP_TITLE=config.APP_TITLE,
         fields=FIELDS,
         form=form,
-        exam_id=exam_id
+        exam_id=exam_id,
+        check=check or {}
     )
 
+def coerce_value(raw: Any) -> Any:
+    """
+    Normaliza um valor de analito: número (aceita vírgula decimal) ou texto.
+    Retorna None para vazio. Levanta ValueError para NaN/infinito, que o
+    JSON do banco não aceita, e para listas/objetos.
+    """
+    if raw is None or isinstance(raw, bool):
+        return None
+    if isinstance(raw, (int, float)):
+        return _finite(float(raw))
+    if not isinstance(raw, str):
+        raise ValueError("valor deve ser número ou texto")
+    val = raw.strip().replace(",", ".")
+    if val == "":
+        return None
+    try:
+        num = float(val)
+    except ValueError:
+        return val
+    return _finite(num)
+
+def _finite(x: float) -> float:
+    if not math.isfinite(x):
+        raise ValueError("valor numérico inválido (NaN/infinito)")
+    return x
+
 def save_exam(exam_id: Optional[int]):
     patient_name = request.form.get("patient_name") or None
     sex = (request.form.get("sex") or "").upper() or None
@@ -36,39 +75,83 @@ def save_exam(exam_id: Optional[int]):
     age_years = int(age_raw)
 
     data: Dict[str, Any] = {}
-    for _, key, _, _ in FIELDS:
-        val = (request.form.get(f"f_{key}") or "").strip().replace(",", ".")
-        if val == "":
-            continue
+    for label, key, _, _ in FIELDS:
         try:
-            v = float(val)
+            v = coerce_value(request.form.get(f"f_{key}"))
         except ValueError:
-            v = val
+            flash(f"Valor inválido em {label}.")
+            if exam_id:
+                return redirect(url_for('edit_exam', exam_id=exam_id))
+            return redirect(url_for('home'))
+        if v is None:
+            continue
         data[key] = v
 
-    conn = db_conn()
+    exam = {
+        "patient_name": patient_name,
+        "sex": sex,
+        "age_years": age_years,
+        "data": data,
+        "source_fp": _source_fp_arg(request.form.get("source_fp")),
+    }
+    if exam_id is None:
+        # Leitura do parser guardada à parte: o reprocessamento preserva o que foi corrigido aqui
+        exam["parsed"] = run_cpu(reparse.parse_source, source_sha(exam["source_fp"]))
+        new_id, inserted = repo.insert_exams([exam])[0]
+        flash("Exame salvo!" if inserted else "Documento já importado anteriormente (nada foi duplicado).")
+        _warn_same_result(exam.get("same_result_as") if inserted else None)
+        return redirect(url_for('chart', exam_id=new_id))
     try:
-        with conn, conn.cursor() as cur:
-            if exam_id is None:
-                cur.execute("""
-                    INSERT INTO exams (patient_name, sex, age_years, data, created_at, updated_at)
-                    VALUES (%s,%s,%s,%s,NOW(),NOW()) RETURNING id
-                """, (patient_name, sex, age_years, Json(data)))
-                new_id = cur.fetchone()[0]
-                flash("Exame salvo!")
-                return redirect(url_for('chart', exam_id=new_id))
-            else:
-                cur.execute("""
-                    UPDATE exams SET patient_name=%s, sex=%s, age_years=%s, data=%s, updated_at=NOW()
-                    WHERE id=%s
-                """, (patient_name, sex, age_years, Json(data), exam_id))
-                flash("Exame atualizado!")
-                return redirect(url_for('chart', exam_id=exam_id))
-    finally:
-        db_put(conn)
+        repo.update_exam(exam_id, exam)
+    except DuplicateExamError:
+        flash("Este documento de origem já está ligado a outro exame; alterações não salvas.")
+        return redirect(url_for('edit_exam', exam_id=exam_id))
+    flash("Exame atualizado!")
+    _warn_same_result(repo.find_exam_by_result_fp(
+        result_fingerprint(patient_name, sex, age_years, data), exclude_id=exam_id))
+    return redirect(url_for('chart', exam_id=exam_id))
+
+def _warn_same_result(other: Optional[int]) -> None:
+    if other:
+        flash(f"Atenção: o exame #{other} tem paciente, idade e resultados idênticos. Confira se não é duplicado.")
+
+def _short_dates(items: List[Dict[str, Any]]) -> None:
+    """
+    Datas ISO do repositório no formato das listagens (AAAA-MM-DD HH:MM).
+    """
+    for it in items:
+        it["created_at"] = it["created_at"][:16].replace("T", " ")
+        it["updated_at"] = it["updated_at"][:16].replace("T", " ")
+
+def _source_fp_arg(raw: Any) -> Optional[str]:
+    """
+    Aceita apenas impressões digitais no formato '<sha256>:<versão>'.
+    """
+    raw = (raw or "").strip() if isinstance(raw, str) else ""
+    return raw if _SOURCE_FP_RE.fullmatch(raw) else None
+
+# Tipos aceitos no import, pela extensão; é também o que /exam/<id>/source serve
+_SOURCE_TYPES = {".pdf": "application/pdf", ".png": "image/png",
+                 ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+def _source_content_type(filename: str) -> Optional[str]:
+    ext = "." + filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return _SOURCE_TYPES.get(ext)
 
 # -------- rotas --------
 
+@app.before_request
+def _start_pool_wait():
+    if config.DB_POOL_WAIT_HEADER:
+        repo.reset_pool_wait()
+
+@app.after_request
+def _report_pool_wait(resp):
+    # Espera por conexão do pool nesta requisição (usado por bench/loadtest.py)
+    if config.DB_POOL_WAIT_HEADER:
+        resp.headers["X-Pool-Wait-Ms"] = f"{repo.pool_wait_ms():.3f}"
+    return resp
+
 @app.context_processor
 def inject_base():
     return {"APP_TITLE": config.APP_TITLE}
@@ -81,70 +164,46 @@ def home():
 
 @app.route("/edit/<int:exam_id>", methods=["GET", "POST"])
 def edit_exam(exam_id: int):
-    conn = db_conn()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute("SELECT id, patient_name, sex, age_years, data::text FROM exams WHERE id=%s", (exam_id,))
-            row = cur.fetchone()
-            if not row:
-                flash("Exame não encontrado.")
-                return redirect(url_for('list_exams'))
-            if request.method == "POST":
-                return save_exam(exam_id)
-            data = json.loads(row[4])
-            form = {"patient_name": row[1], "sex": row[2], "age_years": row[3]}
-            form.update(data)
-            return render_form(form=form, exam_id=exam_id)
-    finally:
-        db_put(conn)
+    exam = repo.get_exam(exam_id)
+    if not exam:
+        flash("Exame não encontrado.")
+        return redirect(url_for('list_exams'))
+    if request.method == "POST":
+        return save_exam(exam_id)
+    form = {"patient_name": exam["patient_name"], "sex": exam["sex"], "age_years": exam["age_years"]}
+    form.update(exam["data"])
+    return render_form(form=form, exam_id=exam_id)
 
 @app.route("/exams")
 def list_exams():
-    conn = db_conn()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, patient_name, age_years, created_at, updated_at
-                FROM exams ORDER BY id DESC LIMIT 200
-            """)
-            items = [
-                {
-                    "id": r[0],
-                    "patient_name": r[1],
-                    "age_years": r[2],
-                    "created_at": r[3].strftime("%Y-%m-%d %H:%M"),
-                    "updated_at": r[4].strftime("%Y-%m-%d %H:%M"),
-                } for r in cur.fetchall()
-            ]
-    finally:
-        db_put(conn)
-    return render_template("list.html", title=config.APP_TITLE, APP_TITLE=config.APP_TITLE, items=items)
+    before_id = request.args.get("before_id", type=int)
+    items = repo.list_exam_summaries(200, before_id)
+    _short_dates(items)
+    next_before = items[-1]["id"] if len(items) == 200 else None
+    return render_template("list.html", title=config.APP_TITLE, APP_TITLE=config.APP_TITLE,
+                           items=items, next_before=next_before)
+
+@app.route("/search")
+def search_exams():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return redirect(url_for("list_exams"))
+    items = repo.search_patients(q, limit=100)
+    _short_dates(items)
+    return render_template("list.html", title=config.APP_TITLE, APP_TITLE=config.APP_TITLE, items=items, q=q)
 
 @app.route("/chart/<int:exam_id>")
 def chart(exam_id: int):
-    conn = db_conn()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute("SELECT id, patient_name, sex, age_years, data::text FROM exams WHERE id=%s", (exam_id,))
-            row = cur.fetchone()
-            if not row:
-                flash("Exame não encontrado.")
-                return redirect(url_for('list_exams'))
-            exam = {
-                "id": row[0],
-                "patient_name": row[1],
-                "sex": row[2],
-                "age_years": row[3],
-                "data": json.loads(row[4]),
-            }
-    finally:
-        db_put(conn)
+    exam = repo.get_exam(exam_id)
+    if not exam:
+        flash("Exame não encontrado.")
+        return redirect(url_for('list_exams'))
 
     items = []
     for label, key, unit, _ in FIELDS:
         v = exam["data"].get(key, None)
         if isinstance(v, (int, float)):
-            lo, hi, u_db = find_ref(key, exam["age_years"], exam["sex"])
+            lo, hi, u_db = repo.find_ref(key, exam["age_years"], exam["sex"])
             unit_final = u_db or unit
             items.append({
                 "key": key,
@@ -159,6 +218,11 @@ def chart(exam_id: int):
         flash("Nenhum valor numérico preenchido para plotar. Edite o exame e informe ao menos um marcador.")
         return redirect(url_for('edit_exam', exam_id=exam_id))
 
+    pop = repo.load_population_stats(exam["sex"], exam["age_years"], [it["key"] for it in items])
+    for it in items:
+        it["population"] = stats.describe(pop.get(it["key"], {}), exam["sex"], exam["age_years"],
+                                          it["value"], config.STATS_MIN_N)
+
     items.sort(key=lambda x: x["label"].lower())
     return render_template("chart.html", title=config.APP_TITLE, APP_TITLE=config.APP_TITLE, exam=exam, items=items)
 
@@ -172,10 +236,25 @@ def import_exam():
         flash("Selecione um arquivo PDF/PNG/JPG.")
         return redirect(url_for("import_exam"))
 
+    filename = secure_filename(file.filename)
+    content_type = _source_content_type(filename)
+    if content_type is None:
+        flash("Formato não suportado. Envie PDF/JPG/PNG.")
+        return redirect(url_for("import_exam"))
+
     try:
         file.stream.seek(0)
-        text = extract_text_from_upload(file)
-        parsed = parse_lab_text_to_form(text)
+        data = file.read()
+        sha = file_sha256(data)
+        source_fp = source_fp_for(sha)
+        text, parsed, scores = run_cpu(ocr_and_parse, data, filename, sha)
+        # Só guarda o que o OCR conseguiu abrir, com o tipo da extensão
+        # validada (nunca o mimetype informado pelo cliente). Registra antes
+        # de gravar: renova created_at (ou espera a coleta em andamento
+        # terminar), então o arquivo não some entre import e save
+        repo.register_blob(sha, len(data), content_type, filename)
+        # fsync de uploads grandes fora do processo web (travaria o loop do gevent)
+        run_cpu(blobstore.put_blob, sha, data)
     except Exception as e:
         flash(f"Falha ao ler arquivo: {e}")
         return redirect(url_for("import_exam"))
@@ -189,25 +268,219 @@ def import_exam():
         "patient_name": parsed.get("_patient_name", ""),
         "sex": "",
         "age_years": parsed.get("_age_years", ""),
+        "source_fp": source_fp,
     }
 
-    flash("Importado via OCR")
-    return render_form({**form, **meta}, exam_id=None)
+    # Valores pouco confiáveis ficam marcados no formulário para conferência
+    check = {k: scores[k]["confidence"] for k in low_confidence(scores, config.PARSE_MIN_CONF) if k in form}
+    flash("Importado via OCR" + (f" — confira {len(check)} valor(es) marcado(s)" if check else ""))
+    return render_form({**form, **meta}, exam_id=None, check=check)
+
+@app.route("/exam/<int:exam_id>/source")
+def exam_source(exam_id: int):
+    """
+    Documento original do exame. send_file com conditional=True responde
+    Range/If-None-Match e usa o file_wrapper (sendfile) do servidor, sem
+    carregar o arquivo na memória do Python. É dado de paciente: nada de
+    cache compartilhado; o navegador revalida pelo ETag (o sha). Tipo fora
+    de _SOURCE_TYPES (registro antigo) sai como octet-stream, com nosniff.
+    """
+    blob = repo.get_exam_blob(exam_id)
+    path = blobstore.existing_path(blob[0]) if blob else None
+    if not path:
+        abort(404)
+    sha, content_type, filename = blob
+    if content_type not in _SOURCE_TYPES.values():
+        content_type = "application/octet-stream"
+    resp = send_file(
+        path,
+        mimetype=content_type,
+        download_name=filename or sha,
+        conditional=True,
+        etag=sha,
+        max_age=0,
+    )
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    return resp
 
 @app.route("/delete/<int:exam_id>", methods=["POST"])
 def delete_exam(exam_id: int):
-    conn = db_conn()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute("DELETE FROM exams WHERE id=%s", (exam_id,))
-            if cur.rowcount == 0:
-                flash(f"Exame #{exam_id} não encontrado.")
-            else:
-                flash(f"Exame #{exam_id} excluído.")
-    finally:
-        db_put(conn)
+    if repo.remove_exam(exam_id):
+        flash(f"Exame #{exam_id} excluído.")
+    else:
+        flash(f"Exame #{exam_id} não encontrado.")
     return redirect(url_for("list_exams"))
 
+# -------- API JSON --------
+
+def _validate_api_exam(obj: Any) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Valida um exame recebido pela API contra constants.FIELDS.
+    Retorna (exame normalizado, erros).
+    """
+    if not isinstance(obj, dict):
+        return None, ["item deve ser um objeto"]
+    errors: List[str] = []
+    patient_name = obj.get("patient_name")
+    if patient_name is not None and not isinstance(patient_name, str):
+        errors.append("patient_name deve ser texto")
+    sex = (obj.get("sex") or "")
+    if not isinstance(sex, str) or sex.upper() not in ("", "M", "F"):
+        errors.append("sex deve ser 'M', 'F' ou vazio")
+        sex = ""
+    age = obj.get("age_years")
+    if isinstance(age, str) and age.strip().isdigit():
+        age = int(age.strip())
+    if not isinstance(age, int) or isinstance(age, bool) or age < 0:
+        errors.append("age_years é obrigatório (inteiro >= 0)")
+    source_fp = obj.get("source_fp")
+    if source_fp is not None and (not isinstance(source_fp, str) or not 0 < len(source_fp) <= 200):
+        errors.append("source_fp deve ser texto (até 200 caracteres)")
+    raw_data = obj.get("data") or {}
+    data: Dict[str, Any] = {}
+    if not isinstance(raw_data, dict):
+        errors.append("data deve ser um objeto {analito: valor}")
+        raw_data = {}
+    for key, raw in raw_data.items():
+        if key not in FIELD_KEYS:
+            errors.append(f"analito desconhecido: {key}")
+            continue
+        try:
+            v = coerce_value(raw)
+        except ValueError as e:
+            errors.append(f"{key}: {e}")
+            continue
+        if v is not None:
+            data[key] = v
+    if errors:
+        return None, errors
+    return {
+        "patient_name": patient_name or None,
+        "sex": sex.upper() or None,
+        "age_years": age,
+        "data": data,
+        "source_fp": source_fp,
+    }, []
+
+def _fields_arg() -> Tuple[Optional[List[str]], Optional[str]]:
+    """
+    Lê ?fields=GLU,HGB. Retorna (lista ou None, erro).
+    """
+    raw = (request.args.get("fields") or "").strip()
+    if not raw:
+        return None, None
+    fields = [f.strip().upper() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in FIELD_KEYS]
+    if unknown:
+        return None, f"analitos desconhecidos: {', '.join(unknown)}"
+    return list(dict.fromkeys(fields)), None
+
+@app.route("/api/exams", methods=["POST"])
+def api_create_exams():
+    payload = request.get_json(silent=True)
+    items = payload.get("exams") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return jsonify(error="envie uma lista de exames (ou {\"exams\": [...]})"), 400
+    if len(items) > config.API_MAX_BATCH:
+        return jsonify(error=f"lote maior que o limite ({config.API_MAX_BATCH})"), 413
+
+    exams: List[Dict[str, Any]] = []
+    errors = []
+    for i, obj in enumerate(items):
+        exam, errs = _validate_api_exam(obj)
+        if errs:
+            errors.append({"index": i, "errors": errs})
+        else:
+            exams.append(exam)
+    if errors:
+        return jsonify(error="validação falhou", details=errors), 422
+
+    res = repo.insert_exams(exams)
+    inserted = sum(1 for _, new in res if new)
+    warnings = [{"index": i, "same_result_as": e["same_result_as"]}
+                for i, (e, (_, new)) in enumerate(zip(exams, res)) if new and e.get("same_result_as")]
+    return jsonify(ids=[rid for rid, _ in res], inserted=inserted,
+                   duplicates=len(res) - inserted, warnings=warnings), 201 if inserted else 200
+
+@app.route("/api/exams", methods=["GET"])
+def api_list_exams():
+    fields, err = _fields_arg()
+    if err:
+        return jsonify(error=err), 400
+    try:
+        limit = int(request.args.get("limit", 100))
+        before_id = request.args.get("before_id")
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify(error="limit/before_id devem ser inteiros"), 400
+    limit = max(1, min(limit, config.API_MAX_LIMIT))
+    items = repo.fetch_exams(fields, limit=limit, before_id=before_id)
+    next_before = items[-1]["id"] if len(items) == limit else None
+    return jsonify(items=items, next_before_id=next_before)
+
+@app.route("/api/patients/search", methods=["GET"])
+def api_search_patients():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify(error="informe q"), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), config.API_MAX_LIMIT))
+    except ValueError:
+        return jsonify(error="limit deve ser inteiro"), 400
+    return jsonify(items=repo.search_patients(q, limit=limit))
+
+@app.route("/api/exams/<int:exam_id>", methods=["GET"])
+def api_get_exam(exam_id: int):
+    fields, err = _fields_arg()
+    if err:
+        return jsonify(error=err), 400
+    exam = repo.fetch_exam(exam_id, fields)
+    if exam is None:
+        return jsonify(error="exame não encontrado"), 404
+    return jsonify(exam)
+
+# -------- comandos (flask --app app.routes <comando>) --------
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recalcula do zero as estatísticas populacionais (analyte_stats)."""
+    n = repo.rebuild_analyte_stats()
+    print(f"analyte_stats reconstruída: {n} grupos")
+
+@app.cli.command("backfill-names")
+@click.option("--batch", type=int, default=1000, help="Exames por transação.")
+@click.option("--limit", type=int, default=None, help="Máximo de exames nesta execução.")
+def backfill_names_command(batch, limit):
+    """Normaliza os nomes de exames antigos para a busca de pacientes."""
+    n = repo.backfill_patient_names(batch=batch, limit=limit)
+    print(f"{n} nomes normalizados")
+
+@app.cli.command("reparse")
+@click.option("--apply", "apply_changes", is_flag=True, help="Grava as diferenças em exams (senão só relata).")
+@click.option("--workers", type=int, default=0, help="Processos do pool (0 = núcleos da máquina).")
+@click.option("--batch", type=int, default=500, help="Exames por lote/transação.")
+@click.option("--checkpoint", default=None, help="Arquivo JSON para retomar de onde parou.")
+@click.option("--report", default=None, help="Arquivo JSONL com as diferenças encontradas.")
+@click.option("--all", "include_current", is_flag=True, help="Inclui exames já na versão atual do parser.")
+def reparse_command(apply_changes, workers, batch, checkpoint, report, include_current):
+    """Reinterpreta os textos guardados com o parser atual (sem refazer OCR)."""
+    totals = reparse.run(apply=apply_changes, workers=workers, batch=batch,
+                         checkpoint=checkpoint, report=report, include_current=include_current)
+    print(json.dumps(totals))
+
+@app.cli.command("gc-blobs")
+@click.option("--grace-hours", type=float, default=24.0, help="Idade mínima de blobs sem referência.")
+def gc_blobs_command(grace_hours):
+    """Apaga arquivos originais que nenhum exame referencia."""
+    removed = repo.collect_unreferenced_blobs(grace_hours, blobstore.delete_blob)
+    print(f"{len(removed)} blobs removidos")
+
+@app.cli.command("ocr-stats")
+def ocr_stats_command():
+    """Resumo das páginas reprocessadas em alta resolução (OCR adaptativo)."""
+    print(json.dumps(escalation_summary(), indent=2))
+
 @app.route("/_ping")
 def ping():
     from datetime import datetime, timezone
@@ -0,0 +1,156 @@
+from __future__ import annotations
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Estatísticas populacionais por analito / faixa etária / sexo.
+# Cada linha de analyte_stats guarda contagem, média e M2 (Welford) e um
+# esboço de quantis em baldes logarítmicos (estilo DDSketch, erro relativo
+# SKETCH_ALPHA). Baldes são contagens: somam (mesclável) e subtraem (exclusão)
+# sem perder exatidão, então save/delete atualizam tudo incrementalmente.
+# Este módulo só faz as contas; a persistência fica em cada backend (app.storage).
+
+SKETCH_ALPHA = 0.01
+_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+_LOG_GAMMA = math.log(_GAMMA)
+
+ALL_SEXES = "*"
+
+Key = Tuple[str, int, str]
+
+def age_band(age: int) -> int:
+    return max(0, int(age)) // 10 * 10
+
+def age_band_label(band: int) -> str:
+    return f"{band}–{band + 9}"
+
+def _bucket(x: float) -> Optional[int]:
+    """
+    Índice do balde de x; None para x <= 0 (balde zero, ordenado antes de todos).
+    """
+    if x <= 0:
+        return None
+    return math.ceil(math.log(x) / _LOG_GAMMA)
+
+def new_acc() -> Dict[str, Any]:
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "sketch": {"z": 0, "b": {}}}
+
+def add_sample(acc: Dict[str, Any], x: float, sign: int) -> None:
+    """
+    Acrescenta (sign=+1) ou remove (sign=-1) uma amostra do acumulador.
+    """
+    n, mean, m2 = acc["n"], acc["mean"], acc["m2"]
+    if sign > 0:
+        n += 1
+        d = x - mean
+        mean += d / n
+        m2 += d * (x - mean)
+    else:
+        if n <= 1:
+            n, mean, m2 = 0, 0.0, 0.0
+        else:
+            new_mean = (n * mean - x) / (n - 1)
+            m2 -= (x - new_mean) * (x - mean)
+            n, mean = n - 1, new_mean
+    acc["n"], acc["mean"], acc["m2"] = n, mean, max(m2, 0.0)
+
+    sk = acc["sketch"]
+    idx = _bucket(x)
+    if idx is None:
+        sk["z"] = max(0, sk.get("z", 0) + sign)
+        return
+    k = str(idx)
+    c = sk["b"].get(k, 0) + sign
+    if c > 0:
+        sk["b"][k] = c
+    else:
+        sk["b"].pop(k, None)
+
+def percentile_rank(acc: Dict[str, Any], x: float) -> Optional[float]:
+    """
+    Percentil (0–100) de x na distribuição do acumulador; o balde de x conta pela metade.
+    """
+    n = acc["n"]
+    if n <= 0:
+        return None
+    sk = acc["sketch"]
+    zero = sk.get("z", 0)
+    idx = _bucket(x)
+    if idx is None:
+        below, same = 0, zero
+    else:
+        below, same = zero, 0
+        for k, c in sk["b"].items():
+            i = int(k)
+            if i < idx:
+                below += c
+            elif i == idx:
+                same += c
+    return max(0.0, min(100.0, 100.0 * (below + 0.5 * same) / n))
+
+def quantile(acc: Dict[str, Any], q: float) -> Optional[float]:
+    """
+    Valor aproximado do quantil q (0–1), com erro relativo ~SKETCH_ALPHA.
+    """
+    n = acc["n"]
+    if n <= 0:
+        return None
+    rank = q * (n - 1)
+    sk = acc["sketch"]
+    seen = sk.get("z", 0)
+    if rank < seen:
+        return 0.0
+    for k in sorted(sk["b"], key=int):
+        seen += sk["b"][k]
+        if rank < seen:
+            i = int(k)
+            return 2 * _GAMMA ** i / (_GAMMA + 1)
+    return None
+
+def exam_samples(sex: Optional[str], age: int, data: Dict[str, Any]) -> Iterable[Tuple[Key, float]]:
+    band = age_band(age)
+    sexes = sexes_for(sex)
+    for key, v in (data or {}).items():
+        if isinstance(v, bool) or not isinstance(v, (int, float)):
+            continue
+        for sx in sexes:
+            yield (key, band, sx), float(v)
+
+def exam_deltas(sex: Optional[str], age: int, data: Dict[str, Any], sign: int) -> List[Tuple[Key, float, int]]:
+    return [(k, x, sign) for k, x in exam_samples(sex, age, data)]
+
+def accumulate(accs: Dict[Key, Dict[str, Any]], deltas: List[Tuple[Key, float, int]]) -> None:
+    """
+    Aplica amostras (+1/-1) em acumuladores já carregados (criando os que faltam).
+    """
+    for k, x, sign in deltas:
+        acc = accs.get(k)
+        if acc is None:
+            acc = accs[k] = new_acc()
+        add_sample(acc, x, sign)
+
+def sexes_for(sex: Optional[str]) -> List[str]:
+    sexes = [ALL_SEXES]
+    if (sex or "").upper() in ("M", "F"):
+        sexes.append(sex.upper())
+    return sexes
+
+def describe(accs: Dict[str, Dict[str, Any]], sex: Optional[str], age: int, value: float,
+             min_n: int) -> Optional[Dict[str, Any]]:
+    """
+    Posição de value na população comparável: prefere o mesmo sexo e cai para
+    todos os sexos se houver poucos exames. None se não houver base suficiente.
+    """
+    sx = (sex or "").upper()
+    for key in ([sx] if sx in ("M", "F") else []) + [ALL_SEXES]:
+        acc = accs.get(key)
+        if acc and acc["n"] >= max(1, min_n):
+            group = {"M": "homens", "F": "mulheres"}.get(key, "pessoas")
+            sd = math.sqrt(acc["m2"] / (acc["n"] - 1)) if acc["n"] > 1 else 0.0
+            return {
+                "percentile": percentile_rank(acc, value),
+                "n": acc["n"],
+                "mean": acc["mean"],
+                "sd": sd,
+                "group": f"{group} de {age_band_label(age_band(age))} anos",
+            }
+    return None
@@ -0,0 +1,23 @@
+from __future__ import annotations
+from typing import Optional
+from .. import config
+from .base import ExamRepository, DuplicateExamError
+
+_REPO: Optional[ExamRepository] = None
+
+def get_repo() -> ExamRepository:
+    """
+    Repositório configurado em DB_BACKEND ("postgres" ou "sqlite"), criado uma vez.
+    Os backends são importados sob demanda: o SQLite não exige psycopg2.
+    """
+    global _REPO
+    if _REPO is None:
+        if config.DB_BACKEND == "sqlite":
+            from .sqlite import SQLiteRepository
+            _REPO = SQLiteRepository(config.SQLITE_PATH)
+        elif config.DB_BACKEND == "postgres":
+            from .postgres import PostgresRepository
+            _REPO = PostgresRepository()
+        else:
+            raise ValueError(f"DB_BACKEND desconhecido: {config.DB_BACKEND!r}")
+    return _REPO
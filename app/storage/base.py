@@ -0,0 +1,145 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Interface de persistência usada pelas rotas, CLI e reprocessamento.
+# Implementações: PostgresRepository (app.db) e SQLiteRepository (embutido).
+# Datas saem sempre como texto ISO 8601 e data como dict {analito: valor}.
+
+# Reprocessamento: (id, data lida no lote, data nova, saída do parser, source_fp)
+ReparseUpdate = Tuple[int, Dict[str, Any], Dict[str, Any], Dict[str, Any], str]
+
+class DuplicateExamError(Exception):
+    """
+    O documento de origem (source_fp) já pertence a outro exame.
+    """
+
+class ExamRepository(ABC):
+
+    # -------- faixas de referência --------
+
+    @abstractmethod
+    def find_ref(self, analyte: str, age: int, sex: Optional[str]) -> Tuple[Optional[float], Optional[float], Optional[str]]:
+        """
+        (ref_low, ref_high, unidade) mais específica para idade/sexo.
+        """
+
+    # -------- exames --------
+
+    @abstractmethod
+    def get_exam(self, exam_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Exame completo para formulário/gráfico: id, patient_name, sex,
+        age_years, data e has_source (arquivo original guardado).
+        """
+
+    @abstractmethod
+    def list_exam_summaries(self, limit: int, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Listagem sem data: id, patient_name, age_years, created_at, updated_at,
+        do mais novo para o mais antigo, paginando por id.
+        """
+
+    @abstractmethod
+    def fetch_exam(self, exam_id: int, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def fetch_exams(self, fields: Optional[List[str]] = None, limit: int = 100,
+                    before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def insert_exams(self, exams: List[Dict[str, Any]]) -> List[Tuple[int, bool]]:
+        """
+        Insere em lote ignorando documentos já importados (source_fp).
+        Devolve [(id, inserido?)] na ordem de entrada e marca em cada item
+        same_result_as: exame anterior com resultado idêntico (só aviso).
+        O item pode trazer parsed: o que o parser leu do documento, base
+        para o reprocessamento distinguir correções manuais.
+        """
+
+    @abstractmethod
+    def update_exam(self, exam_id: int, exam: Dict[str, Any]) -> bool:
+        """
+        False se o exame não existe; DuplicateExamError se o source_fp for de outro.
+        """
+
+    @abstractmethod
+    def remove_exam(self, exam_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    def find_exam_by_result_fp(self, result_fp: str, exclude_id: Optional[int] = None) -> Optional[int]:
+        """
+        Exame mais antigo com o mesmo resultado (result_fp), exceto exclude_id.
+        """
+
+    @abstractmethod
+    def search_patients(self, q: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Busca aproximada por nome, mais parecidos primeiro (campo score, 0–1).
+        """
+
+    def backfill_patient_names(self, batch: int = 1000, limit: Optional[int] = None) -> int:
+        """
+        Normaliza nomes de exames gravados antes da busca aproximada.
+        """
+        return 0
+
+    # -------- estatísticas populacionais --------
+
+    @abstractmethod
+    def load_population_stats(self, sex: Optional[str], age: int,
+                              analytes: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        pass
+
+    @abstractmethod
+    def rebuild_analyte_stats(self) -> int:
+        pass
+
+    # -------- arquivos originais --------
+
+    @abstractmethod
+    def register_blob(self, sha: str, size: int, content_type: Optional[str], filename: Optional[str]) -> None:
+        pass
+
+    @abstractmethod
+    def get_exam_blob(self, exam_id: int) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        pass
+
+    @abstractmethod
+    def collect_unreferenced_blobs(self, grace_hours: float, remove: Callable[[str], Any]) -> List[str]:
+        """
+        Apaga blobs sem referência há mais de grace_hours; remove(sha) apaga
+        o arquivo antes do commit, com a linha ainda travada.
+        """
+
+    # -------- reprocessamento (app.reparse) --------
+
+    @abstractmethod
+    def fetch_reparse_batch(self, after_id: int, limit: int,
+                            skip_version: Optional[str] = None) -> List[Tuple[int, str, Dict[str, Any], Optional[Dict[str, Any]]]]:
+        """
+        [(id, source_fp, data, parsed)] com id > after_id; parsed é None em
+        exames gravados antes de a saída do parser ser guardada.
+        """
+
+    @abstractmethod
+    def apply_reparse(self, updates: List[ReparseUpdate]) -> Tuple[int, List[int]]:
+        """
+        Grava data, parsed e source_fp. Exames cujo data mudou desde a leitura
+        do lote (edição concorrente) ou cujo source_fp colide com outro não
+        são tocados e voltam como conflitos: (gravados, conflitos).
+        """
+
+    # -------- métricas --------
+
+    def reset_pool_wait(self) -> None:
+        pass
+
+    def pool_wait_ms(self) -> float:
+        """
+        Tempo desta requisição esperando o banco (pool ou trava de escrita).
+        """
+        return 0.0
@@ -0,0 +1,71 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .base import ExamRepository, ReparseUpdate
+from .. import db
+
+class PostgresRepository(ExamRepository):
+    """
+    Postgres via psycopg2 (pool de conexões). O SQL continua em app.db;
+    aqui só a adaptação para a interface comum.
+    """
+
+    def find_ref(self, analyte: str, age: int, sex: Optional[str]):
+        return db.find_ref(analyte, age, sex)
+
+    def get_exam(self, exam_id: int) -> Optional[Dict[str, Any]]:
+        return db.get_exam(exam_id)
+
+    def list_exam_summaries(self, limit: int, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        return db.list_exam_summaries(limit, before_id)
+
+    def fetch_exam(self, exam_id: int, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return db.fetch_exam(exam_id, fields)
+
+    def fetch_exams(self, fields: Optional[List[str]] = None, limit: int = 100,
+                    before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        return db.fetch_exams(fields, limit=limit, before_id=before_id)
+
+    def insert_exams(self, exams: List[Dict[str, Any]]) -> List[Tuple[int, bool]]:
+        return db.insert_exams(exams)
+
+    def update_exam(self, exam_id: int, exam: Dict[str, Any]) -> bool:
+        return db.update_exam(exam_id, exam)
+
+    def remove_exam(self, exam_id: int) -> bool:
+        return db.remove_exam(exam_id)
+
+    def find_exam_by_result_fp(self, result_fp: str, exclude_id: Optional[int] = None) -> Optional[int]:
+        return db.find_exam_by_result_fp(result_fp, exclude_id)
+
+    def search_patients(self, q: str, limit: int = 50) -> List[Dict[str, Any]]:
+        return db.search_patients(q, limit)
+
+    def backfill_patient_names(self, batch: int = 1000, limit: Optional[int] = None) -> int:
+        return db.backfill_patient_name_norm(batch, limit)
+
+    def load_population_stats(self, sex: Optional[str], age: int, analytes: List[str]):
+        return db.load_population_stats(sex, age, analytes)
+
+    def rebuild_analyte_stats(self) -> int:
+        return db.rebuild_analyte_stats()
+
+    def register_blob(self, sha: str, size: int, content_type: Optional[str], filename: Optional[str]) -> None:
+        db.register_blob(sha, size, content_type, filename)
+
+    def get_exam_blob(self, exam_id: int):
+        return db.get_exam_blob(exam_id)
+
+    def collect_unreferenced_blobs(self, grace_hours: float, remove: Callable[[str], Any]) -> List[str]:
+        return db.collect_unreferenced_blobs(grace_hours, remove)
+
+    def fetch_reparse_batch(self, after_id: int, limit: int, skip_version: Optional[str] = None):
+        return db.fetch_reparse_batch(after_id, limit, skip_version)
+
+    def apply_reparse(self, updates: List[ReparseUpdate]) -> Tuple[int, List[int]]:
+        return db.apply_reparse(updates)
+
+    def reset_pool_wait(self) -> None:
+        db.reset_pool_wait()
+
+    def pool_wait_ms(self) -> float:
+        return db.pool_wait_ms()
@@ -0,0 +1,575 @@
+from __future__ import annotations
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from .. import config, stats
+from ..constants import REF_RANGES
+from ..fingerprints import result_fingerprint, source_sha
+from ..parsing.parse import normalize_name
+from .base import DuplicateExamError, ExamRepository, ReparseUpdate
+
+# Backend embutido para instalações de uma clínica só: um arquivo, sem
+# servidor. WAL deixa leituras concorrentes com uma escrita; toda escrita
+# abre BEGIN IMMEDIATE (um escritor por vez, sem deadlock de upgrade).
+# O SQL é fixo e parametrizado, então o cache de statements da conexão
+# (cached_statements) reaproveita os statements preparados.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    filename TEXT,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS exams (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    patient_name TEXT,
+    patient_name_norm TEXT,
+    sex TEXT,
+    age_years INTEGER NOT NULL,
+    data TEXT NOT NULL CHECK (json_valid(data)),
+    source_fp TEXT UNIQUE,
+    result_fp TEXT,
+    blob_sha TEXT REFERENCES blobs (sha256),
+    parsed TEXT CHECK (parsed IS NULL OR json_valid(parsed))
+);
+CREATE INDEX IF NOT EXISTS exams_result_fp ON exams (result_fp);
+CREATE INDEX IF NOT EXISTS exams_blob_sha ON exams (blob_sha);
+CREATE TABLE IF NOT EXISTS ref_ranges (
+    id INTEGER PRIMARY KEY,
+    analyte TEXT NOT NULL,
+    unit TEXT,
+    age_min INTEGER,
+    age_max INTEGER,
+    sex TEXT,
+    ref_low REAL,
+    ref_high REAL
+);
+CREATE INDEX IF NOT EXISTS ref_ranges_analyte ON ref_ranges (analyte);
+CREATE TABLE IF NOT EXISTS analyte_stats (
+    analyte TEXT NOT NULL,
+    age_band INTEGER NOT NULL,
+    sex TEXT NOT NULL,
+    n INTEGER NOT NULL DEFAULT 0,
+    mean REAL NOT NULL DEFAULT 0,
+    m2 REAL NOT NULL DEFAULT 0,
+    sketch TEXT NOT NULL DEFAULT '{"z": 0, "b": {}}',
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (analyte, age_band, sex)
+);
+"""
+
+_EXAM_COLS = "id, patient_name, sex, age_years, created_at, updated_at"
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+def _is_unique_violation(e: sqlite3.IntegrityError) -> bool:
+    """
+    Só colisão de UNIQUE/PK (impressão digital repetida); CHECK, NOT NULL e
+    FK continuam sendo erros.
+    """
+    name = getattr(e, "sqlite_errorname", None)
+    if name:
+        return name in ("SQLITE_CONSTRAINT_UNIQUE", "SQLITE_CONSTRAINT_PRIMARYKEY")
+    return str(e).startswith("UNIQUE constraint failed")
+
+# -------- similaridade por trigramas (equivalente ao pg_trgm) --------
+
+_WORD = re.compile(r"[^\W_]+")
+
+@lru_cache(maxsize=8192)
+def _trigrams(s: str) -> Tuple[str, ...]:
+    """
+    Trigramas em ordem, palavra a palavra, com o mesmo preenchimento do
+    pg_trgm ("  w", " wo", ..., "rd ").
+    """
+    out: List[str] = []
+    for w in _WORD.findall((s or "").lower()):
+        p = f"  {w} "
+        out.extend(p[i:i + 3] for i in range(len(p) - 2))
+    return tuple(out)
+
+def similarity(a: Optional[str], b: Optional[str]) -> float:
+    ta, tb = set(_trigrams(a or "")), set(_trigrams(b or ""))
+    if not ta or not tb:
+        return 0.0
+    common = len(ta & tb)
+    return common / (len(ta) + len(tb) - common)
+
+def word_similarity(q: Optional[str], text: Optional[str]) -> float:
+    """
+    Maior similaridade entre os trigramas de q e um trecho contínuo dos
+    trigramas de text (como word_similarity do pg_trgm). O melhor trecho
+    começa e termina em trigramas de q, então só esses pontos são testados.
+    """
+    tq = set(_trigrams(q or ""))
+    seq = _trigrams(text or "")
+    if not tq or not seq:
+        return 0.0
+    hits = [i for i, t in enumerate(seq) if t in tq]
+    if not hits:
+        return 0.0
+    best = 0.0
+    nq = len(tq)
+    for a, i in enumerate(hits):
+        seen = set()
+        common = set()
+        last = i
+        for j in hits[a:]:
+            seen.update(seq[last:j + 1])
+            common.add(seq[j])
+            last = j + 1
+            score = len(common) / (nq + len(seen) - len(common))
+            if score > best:
+                best = score
+    return best
+
+class SQLiteRepository(ExamRepository):
+    """
+    Exames, faixas de referência, estatísticas e blobs num arquivo SQLite.
+    Conexões ficam num pool simples (uma por thread/greenlet em uso);
+    data é JSON em TEXT, projetado por campo com JSON1.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._wait = threading.local()
+
+    # -------- conexões e transações --------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=config.DB_POOL_TIMEOUT, isolation_level=None,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.create_function("word_similarity", 2, word_similarity, deterministic=True)
+        conn.create_function("similarity", 2, similarity, deterministic=True)
+        with self._schema_lock:
+            if not self._schema_ready:
+                self._init_schema(conn)
+                self._schema_ready = True
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        conn.executescript(_SCHEMA)
+        # Arquivos criados antes da coluna parsed (saída do parser, ver reparse)
+        if "parsed" not in {r[1] for r in conn.execute("PRAGMA table_info(exams)")}:
+            conn.execute("ALTER TABLE exams ADD COLUMN parsed TEXT CHECK (parsed IS NULL OR json_valid(parsed))")
+        if conn.execute("SELECT COUNT(*) FROM ref_ranges").fetchone()[0] == 0:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("""
+                INSERT INTO ref_ranges (analyte, unit, age_min, age_max, sex, ref_low, ref_high)
+                VALUES (?,?,?,?,?,?,?)
+            """, REF_RANGES)
+            conn.execute("COMMIT")
+        # Estatísticas nunca construídas com exames já gravados (ver db.bootstrap_analyte_stats)
+        row = conn.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM analyte_stats) AND EXISTS (SELECT 1 FROM exams)
+        """).fetchone()
+        if row[0]:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._rebuild_stats(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self._idle.put(conn)
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        """
+        Transação de escrita: BEGIN IMMEDIATE já reserva a trava de escrita;
+        o tempo esperando por ela entra em pool_wait_ms.
+        """
+        with self._conn() as conn:
+            t0 = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            self._wait.ms = self.pool_wait_ms() + (time.perf_counter() - t0) * 1000
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def reset_pool_wait(self) -> None:
+        self._wait.ms = 0.0
+
+    def pool_wait_ms(self) -> float:
+        return getattr(self._wait, "ms", 0.0)
+
+    # -------- faixas de referência --------
+
+    def find_ref(self, analyte: str, age: int, sex: Optional[str]):
+        with self._conn() as conn:
+            row = conn.execute("""
+                SELECT ref_low, ref_high, unit FROM ref_ranges
+                WHERE analyte=? AND age_min<=? AND age_max>=? AND (sex IS NULL OR sex=?)
+                ORDER BY sex IS NULL, age_min DESC LIMIT 1
+            """, (analyte, age, age, (sex or "").upper() or None)).fetchone()
+        return (row[0], row[1], row[2]) if row else (None, None, None)
+
+    # -------- exames --------
+
+    def get_exam(self, exam_id: int) -> Optional[Dict[str, Any]]:
+        with self._conn() as conn:
+            row = conn.execute("""
+                SELECT id, patient_name, sex, age_years, data, blob_sha FROM exams WHERE id=?
+            """, (exam_id,)).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "patient_name": row[1],
+            "sex": row[2],
+            "age_years": row[3],
+            "data": json.loads(row[4]),
+            "has_source": row[5] is not None,
+        }
+
+    def list_exam_summaries(self, limit: int, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._conn() as conn:
+            rows = conn.execute("""
+                SELECT id, patient_name, age_years, created_at, updated_at
+                FROM exams WHERE ? IS NULL OR id < ? ORDER BY id DESC LIMIT ?
+            """, (before_id, before_id, limit)).fetchall()
+        return [
+            {"id": r[0], "patient_name": r[1], "age_years": r[2], "created_at": r[3], "updated_at": r[4]}
+            for r in rows
+        ]
+
+    @staticmethod
+    def _data_projection(fields: Optional[List[str]]) -> Tuple[str, List[Any]]:
+        """
+        data inteiro ou só as chaves pedidas (json_extract). json_patch sobre
+        '{}' descarta as ausentes (null), como o jsonb_strip_nulls do Postgres.
+        """
+        if not fields:
+            return "data", []
+        parts = ", ".join(["?, json_extract(data, ?)"] * len(fields))
+        params: List[Any] = []
+        for key in fields:
+            params.extend([key, f'$."{key}"'])
+        return f"json_patch('{{}}', json_object({parts}))", params
+
+    @staticmethod
+    def _exam_row_to_dict(r) -> Dict[str, Any]:
+        return {
+            "id": r[0],
+            "patient_name": r[1],
+            "sex": r[2],
+            "age_years": r[3],
+            "created_at": r[4],
+            "updated_at": r[5],
+            "data": json.loads(r[6]),
+        }
+
+    def fetch_exam(self, exam_id: int, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        expr, params = self._data_projection(fields)
+        with self._conn() as conn:
+            row = conn.execute(f"SELECT {_EXAM_COLS}, {expr} FROM exams WHERE id=?",
+                               (*params, exam_id)).fetchone()
+        return self._exam_row_to_dict(row) if row else None
+
+    def fetch_exams(self, fields: Optional[List[str]] = None, limit: int = 100,
+                    before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        expr, params = self._data_projection(fields)
+        with self._conn() as conn:
+            rows = conn.execute(f"""
+                SELECT {_EXAM_COLS}, {expr} FROM exams
+                WHERE ? IS NULL OR id < ? ORDER BY id DESC LIMIT ?
+            """, (*params, before_id, before_id, limit)).fetchall()
+        return [self._exam_row_to_dict(r) for r in rows]
+
+    def insert_exams(self, exams: List[Dict[str, Any]]) -> List[Tuple[int, bool]]:
+        if not exams:
+            return []
+        now = _now()
+        out: List[Tuple[int, bool]] = []
+        deltas = []
+        refs: Dict[str, int] = {}
+        with self._tx() as conn:
+            for e in exams:
+                e["result_fp"] = result_fingerprint(e.get("patient_name"), e.get("sex"), e["age_years"], e["data"])
+                sha = source_sha(e.get("source_fp"))
+                stored = sha and conn.execute("SELECT 1 FROM blobs WHERE sha256=?", (sha,)).fetchone()
+                e["blob_sha"] = sha if stored else None
+                same = conn.execute("SELECT MIN(id) FROM exams WHERE result_fp=?", (e["result_fp"],)).fetchone()
+                e["same_result_as"] = same[0] if same else None
+                cur = conn.execute("""
+                    INSERT INTO exams (patient_name, patient_name_norm, sex, age_years, data,
+                                       source_fp, result_fp, blob_sha, parsed, created_at, updated_at)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+                    ON CONFLICT DO NOTHING
+                """, (e.get("patient_name"), normalize_name(e.get("patient_name")), e.get("sex"),
+                      e["age_years"], json.dumps(e["data"]), e.get("source_fp"), e["result_fp"],
+                      e["blob_sha"], json.dumps(e["parsed"]) if e.get("parsed") is not None else None,
+                      now, now))
+                if cur.rowcount:
+                    out.append((cur.lastrowid, True))
+                    deltas.extend(stats.exam_deltas(e.get("sex"), e["age_years"], e["data"], +1))
+                    if e["blob_sha"]:
+                        refs[e["blob_sha"]] = refs.get(e["blob_sha"], 0) + 1
+                    continue
+                row = conn.execute("SELECT id FROM exams WHERE source_fp=?", (e.get("source_fp"),)).fetchone()
+                out.append((row[0] if row else None, False))
+            self._apply_stats_deltas(conn, deltas)
+            self._adjust_blob_refs(conn, refs)
+        return out
+
+    def update_exam(self, exam_id: int, exam: Dict[str, Any]) -> bool:
+        rfp = result_fingerprint(exam.get("patient_name"), exam.get("sex"), exam["age_years"], exam["data"])
+        try:
+            with self._tx() as conn:
+                old = conn.execute("SELECT sex, age_years, data FROM exams WHERE id=?", (exam_id,)).fetchone()
+                if not old:
+                    return False
+                conn.execute("""
+                    UPDATE exams SET patient_name=?, patient_name_norm=?, sex=?, age_years=?, data=?,
+                        source_fp=COALESCE(?, source_fp), result_fp=?, updated_at=?
+                    WHERE id=?
+                """, (exam.get("patient_name"), normalize_name(exam.get("patient_name")), exam.get("sex"),
+                      exam["age_years"], json.dumps(exam["data"]), exam.get("source_fp"), rfp, _now(), exam_id))
+                self._apply_stats_deltas(conn,
+                    stats.exam_deltas(old[0], old[1], json.loads(old[2]), -1)
+                    + stats.exam_deltas(exam.get("sex"), exam["age_years"], exam["data"], +1))
+                return True
+        except sqlite3.IntegrityError as e:
+            if not _is_unique_violation(e):
+                raise
+            raise DuplicateExamError(str(e)) from e
+
+    def remove_exam(self, exam_id: int) -> bool:
+        with self._tx() as conn:
+            row = conn.execute("SELECT sex, age_years, data, blob_sha FROM exams WHERE id=?", (exam_id,)).fetchone()
+            if not row:
+                return False
+            conn.execute("DELETE FROM exams WHERE id=?", (exam_id,))
+            self._apply_stats_deltas(conn, stats.exam_deltas(row[0], row[1], json.loads(row[2]), -1))
+            if row[3]:
+                self._adjust_blob_refs(conn, {row[3]: -1})
+            return True
+
+    def find_exam_by_result_fp(self, result_fp: str, exclude_id: Optional[int] = None) -> Optional[int]:
+        with self._conn() as conn:
+            row = conn.execute("""
+                SELECT id FROM exams WHERE result_fp=? AND id IS NOT ? ORDER BY id LIMIT 1
+            """, (result_fp, exclude_id)).fetchone()
+        return row[0] if row else None
+
+    def search_patients(self, q: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Mesma semântica da busca no Postgres, mas sem índice: word_similarity
+        roda em Python sobre cada nome (adequado ao volume de uma clínica).
+        """
+        qn = normalize_name(q)
+        if not qn:
+            return []
+        with self._conn() as conn:
+            rows = conn.execute(f"""
+                SELECT * FROM (
+                    SELECT {_EXAM_COLS}, word_similarity(?, patient_name_norm) AS score, patient_name_norm
+                    FROM exams WHERE patient_name_norm IS NOT NULL
+                )
+                WHERE score >= ?
+                ORDER BY score DESC, similarity(?, patient_name_norm) DESC, id DESC
+                LIMIT ?
+            """, (qn, config.SEARCH_MIN_SIMILARITY, qn, limit)).fetchall()
+        return [
+            {
+                "id": r[0],
+                "patient_name": r[1],
+                "sex": r[2],
+                "age_years": r[3],
+                "created_at": r[4],
+                "updated_at": r[5],
+                "score": round(float(r[6]), 3),
+            } for r in rows
+        ]
+
+    # -------- estatísticas populacionais --------
+
+    def _apply_stats_deltas(self, conn: sqlite3.Connection, deltas: List[Tuple[stats.Key, float, int]]) -> None:
+        """
+        Aplica amostras (+1/-1) em analyte_stats dentro da transação corrente
+        (BEGIN IMMEDIATE já serializa os escritores).
+        """
+        if not deltas:
+            return
+        accs: Dict[stats.Key, Dict[str, Any]] = {}
+        for k in sorted({k for k, _, _ in deltas}):
+            row = conn.execute("""
+                SELECT n, mean, m2, sketch FROM analyte_stats WHERE analyte=? AND age_band=? AND sex=?
+            """, k).fetchone()
+            if row:
+                accs[k] = {"n": row[0], "mean": row[1], "m2": row[2], "sketch": json.loads(row[3])}
+        stats.accumulate(accs, deltas)
+        now = _now()
+        conn.executemany("""
+            INSERT INTO analyte_stats (analyte, age_band, sex, n, mean, m2, sketch, updated_at)
+            VALUES (?,?,?,?,?,?,?,?)
+            ON CONFLICT (analyte, age_band, sex) DO UPDATE SET
+                n=excluded.n, mean=excluded.mean, m2=excluded.m2,
+                sketch=excluded.sketch, updated_at=excluded.updated_at
+        """, [(*k, a["n"], a["mean"], a["m2"], json.dumps(a["sketch"]), now) for k, a in accs.items()])
+
+    def load_population_stats(self, sex: Optional[str], age: int, analytes: List[str]):
+        if not analytes:
+            return {}
+        sexes = stats.sexes_for(sex)
+        with self._conn() as conn:
+            rows = conn.execute(f"""
+                SELECT analyte, sex, n, mean, m2, sketch FROM analyte_stats
+                WHERE age_band=? AND sex IN ({",".join("?" * len(sexes))})
+                  AND analyte IN ({",".join("?" * len(analytes))})
+            """, (stats.age_band(age), *sexes, *analytes)).fetchall()
+        out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for a, sx, n, mean, m2, sketch in rows:
+            out.setdefault(a, {})[sx] = {"n": n, "mean": mean, "m2": m2, "sketch": json.loads(sketch)}
+        return out
+
+    def rebuild_analyte_stats(self) -> int:
+        with self._tx() as conn:
+            return self._rebuild_stats(conn)
+
+    @staticmethod
+    def _rebuild_stats(conn: sqlite3.Connection) -> int:
+        accs: Dict[stats.Key, Dict[str, Any]] = {}
+        for sex, age, data in conn.execute("SELECT sex, age_years, data FROM exams"):
+            stats.accumulate(accs, stats.exam_deltas(sex, age, json.loads(data), +1))
+        conn.execute("DELETE FROM analyte_stats")
+        now = _now()
+        conn.executemany("""
+            INSERT INTO analyte_stats (analyte, age_band, sex, n, mean, m2, sketch, updated_at)
+            VALUES (?,?,?,?,?,?,?,?)
+        """, [(*k, a["n"], a["mean"], a["m2"], json.dumps(a["sketch"]), now) for k, a in accs.items()])
+        return len(accs)
+
+    # -------- arquivos originais --------
+
+    @staticmethod
+    def _adjust_blob_refs(conn: sqlite3.Connection, refs: Dict[str, int]) -> None:
+        if refs:
+            conn.executemany("UPDATE blobs SET refcount = refcount + ? WHERE sha256=?",
+                             [(delta, sha) for sha, delta in sorted(refs.items())])
+
+    def register_blob(self, sha: str, size: int, content_type: Optional[str], filename: Optional[str]) -> None:
+        with self._tx() as conn:
+            conn.execute("""
+                INSERT INTO blobs (sha256, size, content_type, filename, created_at)
+                VALUES (?,?,?,?,?) ON CONFLICT (sha256) DO UPDATE SET created_at = excluded.created_at
+            """, (sha, size, content_type, filename, _now()))
+
+    def get_exam_blob(self, exam_id: int):
+        with self._conn() as conn:
+            return conn.execute("""
+                SELECT b.sha256, b.content_type, b.filename
+                FROM exams e JOIN blobs b ON b.sha256 = e.blob_sha
+                WHERE e.id=?
+            """, (exam_id,)).fetchone()
+
+    def collect_unreferenced_blobs(self, grace_hours: float, remove: Callable[[str], Any],
+                                   batch: int = 500) -> List[str]:
+        """
+        Arquivos apagados dentro do BEGIN IMMEDIATE: register_blob e
+        insert_exams esperam a trava e já veem a linha removida.
+        """
+        cutoff = (datetime.now() - timedelta(hours=grace_hours)).isoformat()
+        removed: List[str] = []
+        while True:
+            with self._tx() as conn:
+                shas = [r[0] for r in conn.execute("""
+                    SELECT sha256 FROM blobs
+                    WHERE refcount <= 0 AND created_at < ?
+                      AND NOT EXISTS (SELECT 1 FROM exams e WHERE e.blob_sha = blobs.sha256)
+                    LIMIT ?
+                """, (cutoff, batch))]
+                conn.executemany("DELETE FROM blobs WHERE sha256=?", [(s,) for s in shas])
+                for sha in shas:
+                    remove(sha)
+            removed += shas
+            if len(shas) < batch:
+                return removed
+
+    # -------- reprocessamento --------
+
+    def fetch_reparse_batch(self, after_id: int, limit: int, skip_version: Optional[str] = None):
+        with self._conn() as conn:
+            rows = conn.execute("""
+                SELECT id, source_fp, data, parsed FROM exams
+                WHERE id > ? AND source_fp IS NOT NULL AND (? IS NULL OR source_fp NOT LIKE ?)
+                ORDER BY id LIMIT ?
+            """, (after_id, skip_version, f"%:{skip_version}", limit)).fetchall()
+        return [(r[0], r[1], json.loads(r[2]), json.loads(r[3]) if r[3] else None) for r in rows]
+
+    def _apply_reparse_rows(self, conn: sqlite3.Connection, updates: List[ReparseUpdate]) -> Tuple[int, List[int]]:
+        done = 0
+        deltas = []
+        stale = []
+        now = _now()
+        for exam_id, seen, data, parsed, source_fp in updates:
+            r = conn.execute("SELECT patient_name, sex, age_years, data FROM exams WHERE id=?", (exam_id,)).fetchone()
+            if r is None:
+                continue
+            old = json.loads(r[3])
+            if old != seen:
+                stale.append(exam_id)
+                continue
+            rfp = result_fingerprint(r[0], r[1], r[2], data)
+            conn.execute("UPDATE exams SET data=?, parsed=?, source_fp=?, result_fp=?, updated_at=? WHERE id=?",
+                         (json.dumps(data), json.dumps(parsed), source_fp, rfp, now, exam_id))
+            deltas += stats.exam_deltas(r[1], r[2], old, -1) + stats.exam_deltas(r[1], r[2], data, +1)
+            done += 1
+        self._apply_stats_deltas(conn, deltas)
+        return done, stale
+
+    def apply_reparse(self, updates: List[ReparseUpdate]) -> Tuple[int, List[int]]:
+        if not updates:
+            return 0, []
+        try:
+            with self._tx() as conn:
+                return self._apply_reparse_rows(conn, updates)
+        except sqlite3.IntegrityError as e:
+            if not _is_unique_violation(e):
+                raise
+        done, conflicts = 0, []
+        for u in updates:
+            try:
+                with self._tx() as conn:
+                    n, stale = self._apply_reparse_rows(conn, [u])
+                done += n
+                conflicts += stale
+            except sqlite3.IntegrityError as e:
+                if not _is_unique_violation(e):
+                    raise
+                conflicts.append(u[0])
+        return done, conflicts
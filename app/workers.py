@@ -0,0 +1,65 @@
+from __future__ import annotations
+import multiprocessing as mp
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+from . import config
+from .parsing.ocr import extract_text_and_confs_from_bytes, save_source_text
+from .parsing.parse import parse_lab_text_scored
+
+_EXECUTOR: Optional[ProcessPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Cria (uma vez) o pool de processos para trabalho de CPU (OCR/PDF/parse).
+    Usa 'spawn' para os filhos não herdarem conexões nem o estado do gevent.
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ProcessPoolExecutor(
+                max_workers=config.CPU_WORKERS,
+                mp_context=mp.get_context("spawn"),
+            )
+        return _EXECUTOR
+
+def _discard_executor(broken: ProcessPoolExecutor) -> None:
+    """
+    Descarta o pool quebrado (filho morto por crash/OOM) para o próximo
+    get_executor criar outro; se outra requisição já trocou, não faz nada.
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is broken:
+            _EXECUTOR = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Executa fn(*args) no pool de processos e espera o resultado sem segurar o
+    processo web. Com CPU_WORKERS=0 roda direto, na própria requisição.
+    Se o pool quebrou, recria e tenta mais uma vez.
+    """
+    if config.CPU_WORKERS <= 0:
+        return fn(*args)
+    ex = get_executor()
+    try:
+        return ex.submit(fn, *args).result(timeout=config.CPU_TIMEOUT)
+    except BrokenProcessPool:
+        _discard_executor(ex)
+    return get_executor().submit(fn, *args).result(timeout=config.CPU_TIMEOUT)
+
+def ocr_and_parse(data: bytes, filename: str | None,
+                  sha: str | None = None) -> Tuple[str, Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Extrai o texto e interpreta: (texto, {analito: valor}, {analito: confiança
+    e origem}). Com sha, guarda o texto endereçado pelo hash do arquivo para
+    reprocessamentos futuros (flask reparse).
+    """
+    text, confs = extract_text_and_confs_from_bytes(data, filename)
+    if sha:
+        save_source_text(sha, text)
+    form, fields = parse_lab_text_scored(text, confs)
+    return text, form, fields
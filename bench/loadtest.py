@@ -0,0 +1,331 @@
+"""
+Carga e benchmark ponta a ponta do app Flask.
+
+Popula o banco pela API JSON (/api/exams) com exames realistas e repete uma
+mistura de operações (salvar formulário, gráfico, edição, listagem paginada,
+importação de arquivos de um corpus) com concorrência fixa. Reporta
+p50/p95/p99, vazão e espera pelo pool de conexões (X-Pool-Wait-Ms, enviado
+quando o app roda com DB_POOL_WAIT_HEADER=1) por rota, em JSON, para
+comparar execuções ao longo do tempo.
+
+Exemplos (com o app já rodando apontando para um banco descartável):
+
+    python bench/loadtest.py --seed 20000
+    python bench/loadtest.py --duration 60 --concurrency 32 \\
+        --mix save=1,chart=6,edit=1,list=2,import=0.2 --corpus ./laudos \\
+        --out bench-results/$(date +%Y%m%d-%H%M).json
+
+Sem servidor de banco, suba o app com DB_BACKEND=sqlite e
+SQLITE_PATH=/tmp/bench.sqlite3 (arquivo novo a cada execução).
+
+Só usa a biblioteca padrão.
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import mimetypes
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.constants import FIELDS
+
+FIRST_NAMES = ["MARIA", "ANA", "FRANCISCA", "ANTONIA", "ADRIANA", "JULIANA", "MARCIA", "FERNANDA",
+               "JOSE", "JOAO", "ANTONIO", "FRANCISCO", "CARLOS", "PAULO", "PEDRO", "LUCAS"]
+LAST_NAMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "RODRIGUES", "FERREIRA", "ALVES", "PEREIRA",
+              "LIMA", "GOMES", "COSTA", "RIBEIRO", "MARTINS", "CARVALHO", "ALMEIDA", "LOPES"]
+
+DEFAULT_MIX = "save=1,chart=6,edit=1,list=2"
+
+# ---------- exames sintéticos ----------
+
+def _typical_values() -> Dict[str, float]:
+    """
+    Valor típico por analito, tirado do placeholder do formulário ("ex: 96").
+    """
+    out = {}
+    for _, key, _, ph in FIELDS:
+        m = re.search(r"[\d.]+", ph or "")
+        if m:
+            out[key] = float(m.group(0))
+    return out
+
+_TYPICAL = _typical_values()
+
+def random_exam(rng: random.Random) -> Dict[str, Any]:
+    keys = rng.sample(list(_TYPICAL), rng.randint(8, min(40, len(_TYPICAL))))
+    data = {}
+    for k in keys:
+        base = _TYPICAL[k]
+        v = base * rng.lognormvariate(0, 0.25) if base > 0 else abs(rng.gauss(0, 1))
+        data[k] = round(v, 2 if v < 100 else 0)
+    return {
+        "patient_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "sex": rng.choice(["M", "F"]),
+        "age_years": rng.randint(18, 90),
+        "data": data,
+    }
+
+# ---------- HTTP ----------
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+_OPENER = urllib.request.build_opener(_NoRedirect)
+
+def _request(url: str, data: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+             timeout: float = 120.0) -> Tuple[int, bytes, Dict[str, str]]:
+    req = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with _OPENER.open(req, timeout=timeout) as r:
+            return r.status, r.read(), dict(r.headers)
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), dict(e.headers or {})
+
+def _multipart(field: str, filename: str, payload: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {ctype}\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+# ---------- carga inicial ----------
+
+def seed(base: str, n: int, batch: int, rng: random.Random) -> int:
+    done = 0
+    while done < n:
+        size = min(batch, n - done)
+        body = json.dumps([random_exam(rng) for _ in range(size)]).encode()
+        status, raw, _ = _request(f"{base}/api/exams", body, {"Content-Type": "application/json"})
+        if status not in (200, 201):
+            raise SystemExit(f"falha ao popular ({status}): {raw[:300]!r}")
+        done += size
+        print(f"  {done}/{n} exames", file=sys.stderr)
+    return done
+
+def fetch_ids(base: str, max_ids: int) -> List[int]:
+    ids: List[int] = []
+    before = None
+    while len(ids) < max_ids:
+        q = {"limit": 1000, "fields": "GLU"}
+        if before:
+            q["before_id"] = before
+        status, raw, _ = _request(f"{base}/api/exams?{urllib.parse.urlencode(q)}")
+        if status != 200:
+            raise SystemExit(f"falha ao listar exames ({status})")
+        page = json.loads(raw)
+        ids += [it["id"] for it in page["items"]]
+        before = page.get("next_before_id")
+        if not before:
+            break
+    return ids
+
+# ---------- operações ----------
+
+class Workload:
+    def __init__(self, base: str, ids: List[int], corpus: List[str]):
+        self.base = base
+        self.ids = ids
+        self.corpus = corpus
+
+    def save(self, rng: random.Random) -> Tuple[str, str, Optional[bytes], Dict[str, str]]:
+        e = random_exam(rng)
+        form = {"patient_name": e["patient_name"], "sex": e["sex"], "age_years": str(e["age_years"])}
+        form.update({f"f_{k}": str(v).replace(".", ",") for k, v in e["data"].items()})
+        body = urllib.parse.urlencode(form).encode()
+        return "save", f"{self.base}/", body, {"Content-Type": "application/x-www-form-urlencoded"}
+
+    def chart(self, rng):
+        return "chart", f"{self.base}/chart/{rng.choice(self.ids)}", None, {}
+
+    def edit(self, rng):
+        return "edit", f"{self.base}/edit/{rng.choice(self.ids)}", None, {}
+
+    def list(self, rng):
+        # primeira página na maioria das vezes, às vezes uma página mais funda
+        if not self.ids or rng.random() < 0.7:
+            return "list", f"{self.base}/exams", None, {}
+        return "list", f"{self.base}/exams?before_id={rng.choice(self.ids)}", None, {}
+
+    def home(self, rng):
+        return "home", f"{self.base}/", None, {}
+
+    def import_(self, rng):
+        path = rng.choice(self.corpus)
+        with open(path, "rb") as f:
+            body, ctype = _multipart("file", os.path.basename(path), f.read())
+        return "import", f"{self.base}/import", body, {"Content-Type": ctype}
+
+    def build(self, op: str, rng: random.Random):
+        return getattr(self, "import_" if op == "import" else op)(rng)
+
+# ---------- medição ----------
+
+def _percentile(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    idx = min(len(sorted_vals) - 1, max(0, math.ceil(q * len(sorted_vals)) - 1))
+    return round(sorted_vals[idx], 3)
+
+def _summary(lat: List[float], waits: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    lat = sorted(lat)
+    waits = sorted(waits)
+    return {
+        "count": len(lat),
+        "errors": errors,
+        "throughput_rps": round(len(lat) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(lat) / len(lat), 3) if lat else None,
+            "p50": _percentile(lat, 0.50),
+            "p95": _percentile(lat, 0.95),
+            "p99": _percentile(lat, 0.99),
+            "max": round(lat[-1], 3) if lat else None,
+        },
+        "pool_wait_ms": {
+            "mean": round(sum(waits) / len(waits), 3) if waits else None,
+            "p95": _percentile(waits, 0.95),
+            "max": round(waits[-1], 3) if waits else None,
+        },
+    }
+
+def run(wl: Workload, mix: Dict[str, float], concurrency: int, duration: float,
+        max_requests: Optional[int], seed_value: int) -> Dict[str, Any]:
+    ops = list(mix)
+    weights = [mix[o] for o in ops]
+    lock = threading.Lock()
+    lat: Dict[str, List[float]] = {o: [] for o in ops}
+    waits: Dict[str, List[float]] = {o: [] for o in ops}
+    errors: Dict[str, int] = {o: 0 for o in ops}
+    statuses: Dict[str, Dict[str, int]] = {o: {} for o in ops}
+    issued = [0]
+    deadline = time.perf_counter() + duration
+
+    def worker(i: int):
+        rng = random.Random(seed_value + i)
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests is not None and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            op = rng.choices(ops, weights)[0]
+            name, url, body, headers = wl.build(op, rng)
+            t0 = time.perf_counter()
+            try:
+                status, _, resp_headers = _request(url, body, headers)
+            except Exception:
+                status, resp_headers = 0, {}
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                lat[name].append(ms)
+                statuses[name][str(status)] = statuses[name].get(str(status), 0) + 1
+                if status == 0 or status >= 400:
+                    errors[name] += 1
+                if "X-Pool-Wait-Ms" in resp_headers:
+                    waits[name].append(float(resp_headers["X-Pool-Wait-Ms"]))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        for f in [ex.submit(worker, i) for i in range(concurrency)]:
+            f.result()
+    elapsed = time.perf_counter() - t0
+
+    routes = {}
+    for o in ops:
+        routes[o] = _summary(lat[o], waits[o], errors[o], elapsed)
+        routes[o]["status"] = statuses[o]
+    all_lat = [x for o in ops for x in lat[o]]
+    all_waits = [x for o in ops for x in waits[o]]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "total": _summary(all_lat, all_waits, sum(errors.values()), elapsed),
+        "routes": routes,
+    }
+
+def _parse_mix(raw: str, has_corpus: bool) -> Dict[str, float]:
+    mix = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        name, _, w = part.partition("=")
+        name = name.strip()
+        if name not in ("save", "chart", "edit", "list", "home", "import"):
+            raise SystemExit(f"operação desconhecida no --mix: {name}")
+        mix[name] = float(w or 1)
+    if "import" in mix and not has_corpus:
+        raise SystemExit("--mix com import exige --corpus")
+    return {k: v for k, v in mix.items() if v > 0}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:5000", help="Endereço do app em execução.")
+    ap.add_argument("--seed", type=int, default=0, help="Exames a inserir antes da carga.")
+    ap.add_argument("--seed-batch", type=int, default=1000)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos por operação (padrão: {DEFAULT_MIX}).")
+    ap.add_argument("--corpus", default=None, help="Pasta com PDFs/imagens para a operação import.")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=30.0, help="Segundos de carga.")
+    ap.add_argument("--requests", type=int, default=None, help="Limite total de requisições.")
+    ap.add_argument("--random-seed", type=int, default=42)
+    ap.add_argument("--out", default=None, help="Arquivo JSON de saída (padrão: stdout).")
+    args = ap.parse_args(argv)
+
+    base = args.url.rstrip("/")
+    rng = random.Random(args.random_seed)
+    corpus = []
+    if args.corpus:
+        corpus = sorted(
+            os.path.join(args.corpus, f) for f in os.listdir(args.corpus)
+            if f.lower().endswith((".pdf", ".png", ".jpg", ".jpeg"))
+        )
+        if not corpus:
+            raise SystemExit(f"nenhum PDF/imagem em {args.corpus}")
+    mix = _parse_mix(args.mix, bool(corpus))
+
+    if args.seed:
+        print(f"populando {args.seed} exames...", file=sys.stderr)
+        seed(base, args.seed, args.seed_batch, rng)
+    ids = fetch_ids(base, 50000)
+    if not ids and ({"chart", "edit"} & set(mix)):
+        raise SystemExit("banco vazio: use --seed N")
+
+    print(f"carga: {args.concurrency} clientes, {args.duration}s, mix={mix}", file=sys.stderr)
+    started_at = datetime.now(timezone.utc).isoformat()
+    result = run(Workload(base, ids, corpus), mix, args.concurrency, args.duration,
+                 args.requests, args.random_seed)
+    result = {
+        "started_at": started_at,
+        "config": {
+            "url": base, "concurrency": args.concurrency, "duration_s": args.duration,
+            "requests": args.requests, "mix": mix, "seeded": args.seed,
+            "exam_ids": len(ids), "corpus_files": len(corpus),
+        },
+        **result,
+    }
+    out = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
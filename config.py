@@ -3,16 +3,68 @@ import os
 APP_TITLE = os.getenv("APP_TITLE", "Hemograma + Bioquímica — Registro & Gráfico")
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_ME_SUPER_SECRET")
 
+# Armazenamento: "postgres" (servidor) ou "sqlite" (arquivo local, sem servidor)
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.getcwd(), "exames.sqlite3"))
+
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "teste")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASS = os.getenv("DB_PASS", "postgres")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Segundos esperando uma conexão livre antes de desistir
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Cabeçalho X-Pool-Wait-Ms em cada resposta (bench/loadtest.py); desligado em produção
+DB_POOL_WAIT_HEADER = os.getenv("DB_POOL_WAIT_HEADER", "0") == "1"
+
+# Processos para OCR/parse fora do processo web (0 = executa na própria requisição)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0"))
+CPU_TIMEOUT = float(os.getenv("CPU_TIMEOUT", "300"))
 
 # OCR / PDF
 TESSERACT_CMD = os.getenv("TESSERACT_CMD", r"D:\tesseract\tesseract.exe")
 POPPLER_PATH = os.getenv("POPPLER_PATH", None)
 OCR_LANGS = os.getenv("OCR_LANGS", "por+eng")
 
+# OCR adaptativo de PDFs escaneados: 1ª passada em baixa resolução e nova
+# renderização em alta só nas páginas com confiança ou analitos abaixo do mínimo
+OCR_ADAPTIVE = os.getenv("OCR_ADAPTIVE", "1") == "1"
+OCR_LOW_DPI = int(os.getenv("OCR_LOW_DPI", "150"))
+OCR_HIGH_DPI = int(os.getenv("OCR_HIGH_DPI", "300"))
+OCR_MIN_CONF = float(os.getenv("OCR_MIN_CONF", "70"))
+OCR_MIN_ANALYTES = int(os.getenv("OCR_MIN_ANALYTES", "1"))
+
+# Confiança mínima (0–1) de um valor extraído; abaixo disso a região do laudo
+# onde ele está é relida por OCR e o valor é destacado para conferência
+PARSE_MIN_CONF = float(os.getenv("PARSE_MIN_CONF", "0.6"))
+
+# Recortar blocos de texto antes do OCR (margens, logos e códigos de barras ficam de fora)
+OCR_LAYOUT_CROP = os.getenv("OCR_LAYOUT_CROP", "1") == "1"
+# Blocos com fração de tinta acima disso são tratados como imagem/código de barras
+OCR_LAYOUT_MAX_INK = float(os.getenv("OCR_LAYOUT_MAX_INK", "0.35"))
+
+# PDFs página a página: página com imagem e menos texto que isso é digitalizada (OCR)
+PDF_PAGE_MIN_TEXT = int(os.getenv("PDF_PAGE_MIN_TEXT", "40"))
+# Parar após N páginas seguidas sem resultados (depois de já ter achado algum); 0 = nunca.
+# Desligado por padrão: laudos intercalam métodos/assinaturas entre grupos de resultados
+PDF_STOP_AFTER_EMPTY = int(os.getenv("PDF_STOP_AFTER_EMPTY", "0"))
+
 # Onde salvar os dumps de texto extraído
 TEXT_DUMP_DIR = os.getenv("TEXT_DUMP_DIR", os.path.join(os.getcwd(), "pdf_text_dumps"))
+
+# Arquivos originais (PDF/imagem), endereçados pelo SHA-256
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(os.getcwd(), "blobs"))
+# Delegar o envio ao servidor web (X-Sendfile) quando houver proxy configurado
+BLOB_X_SENDFILE = os.getenv("BLOB_X_SENDFILE", "0") == "1"
+
+# API JSON
+API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", "10000"))
+API_MAX_LIMIT = int(os.getenv("API_MAX_LIMIT", "1000"))
+
+# Percentis populacionais: mínimo de exames no grupo para exibir
+STATS_MIN_N = int(os.getenv("STATS_MIN_N", "20"))
+
+# Busca de pacientes: similaridade mínima (pg_trgm word_similarity, 0–1)
+SEARCH_MIN_SIMILARITY = float(os.getenv("SEARCH_MIN_SIMILARITY", "0.4"))
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Testes rodam no backend embutido, sem servidor de banco
+os.environ.setdefault("DB_BACKEND", "sqlite")
+
+# config.py fica na raiz do projeto; os módulos de app importam "from . import config"
+import config  # noqa: E402
+import app  # noqa: E402
+
+sys.modules.setdefault("app.config", config)
+app.config = config
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """
+    SQLiteRepository num arquivo novo; blobs e textos extraídos também em tmp_path.
+    """
+    from app import storage
+    from app.storage.sqlite import SQLiteRepository
+    monkeypatch.setattr(config, "BLOB_DIR", str(tmp_path / "blobs"))
+    monkeypatch.setattr(config, "TEXT_DUMP_DIR", str(tmp_path / "dumps"))
+    r = SQLiteRepository(str(tmp_path / "exams.sqlite3"))
+    monkeypatch.setattr(storage, "_REPO", r)
+    return r
+
+
+@pytest.fixture
+def client(repo, monkeypatch):
+    pytest.importorskip("flask")
+    from app import routes
+    monkeypatch.setattr(routes, "repo", repo)
+    routes.app.config["TESTING"] = True
+    return routes.app.test_client()
@@ -0,0 +1,77 @@
+import pytest
+
+
+def _post(client, items):
+    return client.post("/api/exams", json={"exams": items})
+
+
+def test_create_and_read_back(client):
+    r = _post(client, [{"patient_name": "Maria", "sex": "f", "age_years": 40,
+                        "data": {"GLU": "92,5", "HGB": 13, "TSH": ""}}])
+    assert r.status_code == 201
+    assert r.get_json()["inserted"] == 1
+    exam_id = r.get_json()["ids"][0]
+    got = client.get(f"/api/exams/{exam_id}").get_json()
+    assert got["sex"] == "F"
+    assert got["data"] == {"GLU": 92.5, "HGB": 13.0}
+
+
+@pytest.mark.parametrize("value", [[1, 2], {"v": 1}, "NaN", float("inf")])
+def test_rejects_non_scalar_and_non_finite_values(client, value):
+    r = _post(client, [{"age_years": 40, "data": {"GLU": 90}},
+                       {"age_years": 40, "data": {"GLU": value}}])
+    assert r.status_code == 422
+    details = r.get_json()["details"]
+    assert [d["index"] for d in details] == [1]
+    assert details[0]["errors"][0].startswith("GLU:")
+    # nada é gravado se algum item falha
+    assert client.get("/api/exams").get_json()["items"] == []
+
+
+@pytest.mark.parametrize("item, message", [
+    ({"data": {"GLU": 90}}, "age_years"),
+    ({"age_years": -1}, "age_years"),
+    ({"age_years": 40, "sex": "X"}, "sex"),
+    ({"age_years": 40, "data": {"NOPE": 1}}, "analito desconhecido"),
+    ({"age_years": 40, "data": [1]}, "data deve ser"),
+    ("exame", "objeto"),
+])
+def test_item_validation_errors(client, item, message):
+    r = _post(client, [item])
+    assert r.status_code == 422
+    assert message in r.get_json()["details"][0]["errors"][0]
+
+
+def test_batch_shape_and_limit(client, monkeypatch):
+    import config
+    assert client.post("/api/exams", json={"exams": []}).status_code == 400
+    monkeypatch.setattr(config, "API_MAX_BATCH", 1)
+    assert _post(client, [{"age_years": 1}, {"age_years": 2}]).status_code == 413
+
+
+def test_fields_projection(client):
+    _post(client, [{"patient_name": "Ana", "age_years": 30, "data": {"GLU": 90, "HGB": 12, "TSH": 2}}])
+    items = client.get("/api/exams?fields=glu,TSH,GLU").get_json()["items"]
+    assert items[0]["data"] == {"GLU": 90.0, "TSH": 2.0}
+    assert items[0]["patient_name"] == "Ana"
+    one = client.get(f"/api/exams/{items[0]['id']}?fields=HGB").get_json()
+    assert one["data"] == {"HGB": 12.0}
+    # analito pedido mas ausente no exame não aparece
+    assert client.get(f"/api/exams/{items[0]['id']}?fields=HGB,LDL").get_json()["data"] == {"HGB": 12.0}
+    assert client.get("/api/exams?fields=NOPE").status_code == 400
+
+
+def test_pagination_by_before_id(client):
+    ids = _post(client, [{"age_years": n} for n in range(5)]).get_json()["ids"]
+    page = client.get("/api/exams?limit=2").get_json()
+    assert [it["id"] for it in page["items"]] == ids[:-3:-1]
+    rest = client.get(f"/api/exams?limit=10&before_id={page['next_before_id']}").get_json()
+    assert [it["id"] for it in rest["items"]] == ids[-3::-1]
+    assert rest["next_before_id"] is None
+
+
+def test_pool_wait_header_only_when_enabled(client, monkeypatch):
+    import config
+    assert "X-Pool-Wait-Ms" not in client.get("/api/exams").headers
+    monkeypatch.setattr(config, "DB_POOL_WAIT_HEADER", True)
+    assert float(client.get("/api/exams").headers["X-Pool-Wait-Ms"]) >= 0
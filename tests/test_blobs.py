@@ -0,0 +1,67 @@
+import io
+import os
+
+from app import blobstore, routes
+from app.fingerprints import file_sha256
+
+HTML = b"<html><script>alert(1)</script></html>"
+
+
+def test_put_blob_is_idempotent_and_delete_is_safe(repo):
+    sha = file_sha256(b"conteudo")
+    path, wrote = blobstore.put_blob(sha, b"conteudo")
+    assert wrote and blobstore.existing_path(sha) == path
+    assert blobstore.put_blob(sha, b"conteudo") == (path, False)
+    assert not [n for n in os.listdir(os.path.dirname(path)) if n.endswith(".tmp")]
+    assert blobstore.delete_blob(sha) and not blobstore.delete_blob(sha)
+    assert blobstore.existing_path(sha) is None and blobstore.existing_path(None) is None
+
+
+def _upload(client, name, data):
+    return client.post("/import", data={"file": (io.BytesIO(data), name)},
+                       content_type="multipart/form-data")
+
+
+def test_failed_import_stores_nothing(client, repo):
+    sha = file_sha256(HTML)
+    assert _upload(client, "laudo.pdf", HTML).status_code == 302
+    assert _upload(client, "laudo.html", HTML).status_code == 302
+    assert blobstore.existing_path(sha) is None
+    # o source_fp do arquivo recusado não liga blob nenhum ao exame
+    client.post("/", data={"patient_name": "Ana", "age_years": "30", "source_fp": f"{sha}:2"})
+    [(exam_id, *_)] = repo.fetch_reparse_batch(0, 10, None)
+    assert repo.get_exam_blob(exam_id) is None
+    assert client.get(f"/exam/{exam_id}/source").status_code == 404
+
+
+def test_import_stores_blob_with_type_from_extension(client, repo, monkeypatch):
+    monkeypatch.setattr(routes, "ocr_and_parse", lambda data, name, sha: ("", {}, {}))
+    data = b"%PDF-1.4 laudo"
+    sha = file_sha256(data)
+    resp = client.post("/import", data={"file": (io.BytesIO(data), "Laudo.PDF", "text/html")},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 200
+    assert blobstore.existing_path(sha)
+
+    client.post("/", data={"patient_name": "Ana", "age_years": "30", "source_fp": f"{sha}:2"})
+    [(exam_id, *_)] = repo.fetch_reparse_batch(0, 10, None)
+    assert repo.get_exam_blob(exam_id) == (sha, "application/pdf", "Laudo.PDF")
+
+    resp = client.get(f"/exam/{exam_id}/source")
+    assert resp.status_code == 200 and resp.data == data
+    assert resp.mimetype == "application/pdf"
+    assert resp.headers["X-Content-Type-Options"] == "nosniff"
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    assert client.get(f"/exam/{exam_id}/source", headers={"If-None-Match": f'"{sha}"'}).status_code == 304
+
+
+def test_source_never_serves_unvalidated_type(client, repo):
+    # registro gravado antes da validação por extensão
+    sha = file_sha256(HTML)
+    repo.register_blob(sha, len(HTML), "text/html", "laudo.pdf")
+    blobstore.put_blob(sha, HTML)
+    [(exam_id, _)] = repo.insert_exams([{"patient_name": "Ana", "age_years": 30, "data": {},
+                                         "source_fp": f"{sha}:2"}])
+    resp = client.get(f"/exam/{exam_id}/source")
+    assert resp.mimetype == "application/octet-stream"
+    assert resp.headers["X-Content-Type-Options"] == "nosniff"
@@ -0,0 +1,29 @@
+from app.fingerprints import (file_sha256, result_fingerprint, source_fingerprint,
+                              source_fp_for, source_sha)
+from app.parsing.parse import PARSER_VERSION
+
+
+def test_source_fingerprint_is_sha_and_parser_version():
+    fp = source_fingerprint(b"pdf")
+    assert fp == f"{file_sha256(b'pdf')}:{PARSER_VERSION}"
+    assert source_sha(fp) == file_sha256(b"pdf")
+    assert source_fp_for(file_sha256(b"pdf"), "1") != fp
+
+
+def test_source_sha_rejects_other_formats():
+    assert source_sha(None) is None
+    assert source_sha("") is None
+    assert source_sha("abc:2") is None
+
+
+def test_result_fingerprint_ignores_key_order_accents_and_case():
+    a = result_fingerprint("José Antônio", "m", 40, {"GLU": 92, "HGB": 14.2})
+    b = result_fingerprint("JOSE ANTONIO", "M", 40, {"HGB": 14.2, "GLU": 92.0})
+    assert a == b
+
+
+def test_result_fingerprint_distinguishes_patient_and_values():
+    base = result_fingerprint("Maria", "F", 30, {"GLU": 92})
+    assert result_fingerprint("Mario", "F", 30, {"GLU": 92}) != base
+    assert result_fingerprint("Maria", "F", 31, {"GLU": 92}) != base
+    assert result_fingerprint("Maria", "F", 30, {"GLU": 93}) != base
@@ -0,0 +1,51 @@
+import pytest
+
+for _mod in ("PIL", "pdfplumber", "pdf2image", "pytesseract", "werkzeug"):
+    pytest.importorskip(_mod)
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from app.parsing import ocr  # noqa: E402
+
+
+def _text_block(draw, box):
+    # "texto": traços finos espaçados, abaixo de OCR_LAYOUT_MAX_INK
+    x0, y0, x1, y1 = box
+    for x in range(x0, x1, 4):
+        draw.line((x, y0, x, y1), fill=0)
+
+
+def test_find_text_blocks_skips_margins_and_dense_blocks():
+    img = Image.new("L", (400, 600), 255)
+    draw = ImageDraw.Draw(img)
+    _text_block(draw, (40, 50, 300, 70))
+    draw.rectangle((40, 200, 300, 260), fill=0)  # logo/código de barras
+    _text_block(draw, (60, 400, 200, 420))
+    blocks = ocr.find_text_blocks(img)
+    assert len(blocks) == 2
+    (ax0, ay0, ax1, ay1), (bx0, by0, _, _) = blocks
+    assert ax0 <= 40 and ax1 >= 300 and ay0 <= 50 and ay1 >= 70
+    assert ax0 > 0 and bx0 > ax0 and by0 > ay1
+
+
+def test_compact_layout_segments_follow_reading_order():
+    img = Image.new("L", (400, 600), 255)
+    draw = ImageDraw.Draw(img)
+    _text_block(draw, (40, 50, 300, 70))
+    _text_block(draw, (60, 400, 200, 420))
+    compact, segments = ocr.compact_layout(img)
+    assert compact.size[1] < img.size[1]
+    assert [y for y, _ in segments] == sorted(y for y, _ in segments)
+    assert [b for _, b in segments] == ocr.find_text_blocks(img)
+
+
+def test_find_text_blocks_keeps_columns_and_table_rows_in_one_band():
+    img = Image.new("L", (400, 600), 255)
+    draw = ImageDraw.Draw(img)
+    # tabela: rótulos à esquerda, valores à direita, linhas próximas
+    for y in range(100, 220, 12):
+        _text_block(draw, (40, y, 140, y + 6))
+        _text_block(draw, (260, y, 340, y + 6))
+    [(x0, y0, x1, y1)] = ocr.find_text_blocks(img)
+    assert x0 <= 40 and x1 >= 340
+    assert y0 <= 100 and y1 >= 214
@@ -0,0 +1,20 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "bench"))
+
+import loadtest  # noqa: E402
+
+
+def test_list_works_on_empty_database():
+    wl = loadtest.Workload("http://app", [], [])
+    rng = random.Random(1)
+    assert {wl.list(rng)[1] for _ in range(50)} == {"http://app/exams"}
+
+
+def test_list_pages_through_known_ids():
+    wl = loadtest.Workload("http://app", [7], [])
+    rng = random.Random(1)
+    urls = {wl.list(rng)[1] for _ in range(50)}
+    assert urls == {"http://app/exams", "http://app/exams?before_id=7"}
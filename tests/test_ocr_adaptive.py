@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+for _mod in ("PIL", "pdfplumber", "pdf2image", "pytesseract", "werkzeug"):
+    pytest.importorskip(_mod)
+
+import config  # noqa: E402
+from app.parsing import ocr  # noqa: E402
+from app.parsing.ocr import OcrLine  # noqa: E402
+
+A, B = (0, 0, 100, 20), (0, 40, 100, 60)
+
+
+@pytest.fixture
+def page(monkeypatch, tmp_path):
+    """
+    Página falsa: a passada em baixa resolução devolve as regiões dadas; a
+    releitura de cada recorte devolve hi[box em alta resolução].
+    """
+    monkeypatch.setattr(config, "TEXT_DUMP_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "OCR_LOW_DPI", 150)
+    monkeypatch.setattr(config, "OCR_HIGH_DPI", 300)
+    monkeypatch.setattr(config, "OCR_MIN_CONF", 70.0)
+    monkeypatch.setattr(config, "OCR_MIN_ANALYTES", 1)
+    monkeypatch.setattr(config, "PARSE_MIN_CONF", 0.7)
+    state = {"low": [], "hi": {}, "dpis": [], "crops": []}
+
+    class Rendered:
+        mode = "L"
+
+        def crop(self, box):
+            return box
+
+    def render(b, page_no, dpi):
+        state["dpis"].append(dpi)
+        return Rendered()
+
+    def ocr_lines(box, psm=None):
+        state["crops"].append(box)
+        return state["hi"].get(box, [])
+
+    monkeypatch.setattr(ocr, "_render_page", render)
+    monkeypatch.setattr(ocr, "_ocr_regions", lambda img, psm=None: [(box, list(lns)) for box, lns in state["low"]])
+    monkeypatch.setattr(ocr, "_ocr_lines", ocr_lines)
+    return state
+
+
+def _line(text, conf=90.0):
+    return OcrLine(text, conf, len(text.split()), 0)
+
+
+def _log():
+    with open(ocr._escalation_log_path(), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_clean_page_is_not_rendered_again(page):
+    page["low"] = [(A, [_line("HEMOGLOBINA 14,2 g/dL")]), (B, [_line("GLICOSE 92 mg/dL")])]
+    txt, confs, has_results = ocr._ocr_pdf_page_adaptive(b"", 1, "a.pdf")
+    assert has_results and txt.splitlines() == ["HEMOGLOBINA 14,2 g/dL", "GLICOSE 92 mg/dL"]
+    assert page["dpis"] == [150]
+    [entry] = _log()
+    assert entry["escalated"] is False and entry["reason"] is None and entry["skipped"] is False
+
+
+def test_low_confidence_rereads_only_weak_region_at_high_dpi(page):
+    page["low"] = [(A, [_line("HEMOGLOBINA 14,2 g/dL")]), (B, [_line("GLlC0SE 9Z mg/dL", 30.0)])]
+    page["hi"] = {(0, 80, 200, 120): [_line("GLICOSE 92 mg/dL", 88.0)]}
+    txt, confs, has_results = ocr._ocr_pdf_page_adaptive(b"", 1, "a.pdf")
+    assert page["dpis"] == [150, 300]
+    # recorte em coordenadas da página em alta resolução (x2)
+    assert page["crops"] == [(0, 80, 200, 120)]
+    assert txt.splitlines() == ["HEMOGLOBINA 14,2 g/dL", "GLICOSE 92 mg/dL"]
+    assert confs == [90.0, 88.0]
+    [entry] = _log()
+    assert entry["reason"] == "conf" and entry["retried"] == 1 and entry["replaced"] == 1
+    assert entry["analytes_hi"] == 2
+
+
+def test_worse_reread_keeps_low_resolution_text(page):
+    page["low"] = [(A, [_line("GLICOSE 92 mg/dL", 40.0)])]
+    page["hi"] = {(0, 0, 200, 40): [_line("ruído", 20.0)]}
+    txt, _, _ = ocr._ocr_pdf_page_adaptive(b"", 1, "a.pdf")
+    assert txt == "GLICOSE 92 mg/dL"
+    assert _log()[0]["replaced"] == 0
+
+
+def test_too_few_analytes_rereads_every_region(page, monkeypatch):
+    monkeypatch.setattr(config, "OCR_MIN_ANALYTES", 2)
+    page["low"] = [(A, [_line("Paciente: Ana Souza")]), (B, [_line("GLICOSE 92 mg/dL")])]
+    ocr._ocr_pdf_page_adaptive(b"", 1, "a.pdf")
+    assert page["crops"] == [(0, 0, 200, 40), (0, 80, 200, 120)]
+    assert _log()[0]["reason"] == "analytes"
+
+
+def test_page_without_results_is_skipped(page):
+    page["low"] = [(A, [_line("Método: quimioluminescência")]), (B, [_line("Assinatura eletrônica")])]
+    _, _, has_results = ocr._ocr_pdf_page_adaptive(b"", 3, "a.pdf")
+    assert not has_results and page["dpis"] == [150]
+    assert _log()[0]["skipped"] is True
+
+
+def test_escalation_summary_rate_by_reason(page):
+    assert ocr.escalation_summary() == {"pages": 0, "escalated": 0, "rate": None, "reasons": {}}
+    page["low"] = [(A, [_line("HEMOGLOBINA 14,2 g/dL")])]
+    ocr._ocr_pdf_page_adaptive(b"", 1, "a.pdf")
+    page["low"] = [(A, [_line("HEMOGLOBINA 14,2 g/dL", 40.0)])]
+    ocr._ocr_pdf_page_adaptive(b"", 2, "a.pdf")
+    ocr._ocr_pdf_page_adaptive(b"", 3, "a.pdf")
+    assert ocr.escalation_summary() == {"pages": 3, "escalated": 2, "rate": 2 / 3, "reasons": {"conf": 2}}
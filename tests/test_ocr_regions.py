@@ -0,0 +1,83 @@
+import pytest
+
+for _mod in ("PIL", "pdfplumber", "pdf2image", "pytesseract", "werkzeug"):
+    pytest.importorskip(_mod)
+
+from PIL import Image  # noqa: E402
+
+import config  # noqa: E402
+from app.parsing import ocr  # noqa: E402
+from app.parsing.ocr import OcrLine  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _thresholds(monkeypatch):
+    monkeypatch.setattr(config, "OCR_LAYOUT_CROP", True)
+    monkeypatch.setattr(config, "OCR_MIN_CONF", 70.0)
+    monkeypatch.setattr(config, "PARSE_MIN_CONF", 0.7)
+
+
+def _line(text, conf=90.0, words=2, top=0):
+    return OcrLine(text, conf, words, top)
+
+
+def test_ocr_regions_assigns_lines_by_segment_start(monkeypatch):
+    a, b = (0, 0, 10, 10), (0, 50, 10, 60)
+    monkeypatch.setattr(ocr, "compact_layout", lambda img: (img, [(0, a), (100, b)]))
+    monkeypatch.setattr(ocr, "_ocr_lines", lambda im, psm=None: [
+        _line("l1", top=10), _line("l2", top=99), _line("l3", top=100), _line("l4", top=150),
+    ])
+    regions = ocr._ocr_regions(Image.new("RGB", (10, 10), "white"))
+    assert [box for box, _ in regions] == [a, b]
+    assert [[ln.text for ln in lns] for _, lns in regions] == [["l1", "l2"], ["l3", "l4"]]
+
+
+def test_regions_text_maps_lines_to_owner_region():
+    regions = [
+        ((0, 0, 1, 1), [_line("HEMOGLOBINA 14,2 g/dL", 91.0), _line("---", 0.0, words=0)]),
+        ((0, 0, 1, 1), []),
+        ((0, 0, 1, 1), [_line("GLICOSE 92 mg/dL", 55.0)]),
+    ]
+    text, confs, owner = ocr._regions_text(regions)
+    assert text.splitlines() == ["HEMOGLOBINA 14,2 g/dL", "---", "GLICOSE 92 mg/dL"]
+    assert confs == [91.0, None, 55.0]
+    assert owner == [0, 0, 2]
+
+
+def _weak(regions):
+    text, confs, owner = ocr._regions_text(regions)
+    _, fields = ocr.parse_lab_text_scored(text, confs)
+    return ocr._weak_regions(regions, fields, owner), fields
+
+
+def test_weak_regions_low_word_confidence_and_low_confidence_analyte():
+    regions = [
+        ((0, 0, 1, 1), [_line("Laudo", 95.0)]),
+        ((0, 0, 1, 1), [_line("GLICOSE 92 mg/dL", 75.0)]),   # palavras e analito (0.75) ok
+        ((0, 0, 1, 1), [_line("FERRO 80", 80.0)]),           # sem unidade: analito fraco
+        ((0, 0, 1, 1), [_line("obs ilegível", 30.0)]),       # palavras fracas
+    ]
+    weak, fields = _weak(regions)
+    assert fields["FE"]["confidence"] < config.PARSE_MIN_CONF <= fields["GLU"]["confidence"]
+    assert weak == [2, 3]
+
+
+def test_weak_regions_ignores_regions_without_words():
+    regions = [
+        ((0, 0, 1, 1), [_line("HEMOGLOBINA 14,2 g/dL", 95.0)]),
+        ((0, 0, 1, 1), []),
+        ((0, 0, 1, 1), [_line("|||", 0.0, words=0)]),
+    ]
+    weak, _ = _weak(regions)
+    assert weak == []
+
+
+def test_weak_regions_keeps_empty_region_owning_weak_analyte():
+    regions = [
+        ((0, 0, 1, 1), [_line("HEMOGLOBINA", 95.0)]),
+        ((0, 0, 1, 1), [_line("14,2", 0.0, words=0)]),   # valor sem unidade nem confiança
+    ]
+    weak, fields = _weak(regions)
+    assert (fields["HGB"]["line"], fields["HGB"]["label_line"]) == (2, 1)
+    assert fields["HGB"]["confidence"] < config.PARSE_MIN_CONF
+    assert weak == [0, 1]
@@ -0,0 +1,73 @@
+import pytest
+
+from app.parsing.parse import page_has_results, parse_lab_text_to_form
+
+
+@pytest.mark.parametrize("text", [
+    "HEMOGLOBINA: 14,2 g/dL 13,0 a 17,0",
+    "GLICOSE\n92 mg/dL",
+    "Paciente: MARIA DA SILVA\nIdade: 40",
+])
+def test_page_with_results(text):
+    assert page_has_results(text)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Página 2 de 3",
+    "Método: enzimático colorimétrico\nResponsável técnico",
+])
+def test_page_without_results(text):
+    assert not page_has_results(text)
+
+
+class _Page:
+    def __init__(self, text, images=()):
+        self.text, self.images = text, list(images)
+
+    def extract_text(self):
+        return self.text
+
+
+@pytest.fixture
+def pdf_pages(monkeypatch):
+    """iter_pdf_pages sobre páginas de camada de texto dadas, sem PDF real."""
+    pytest.importorskip("pdfplumber")
+    from contextlib import nullcontext
+    from types import SimpleNamespace
+    from app.parsing import ocr
+
+    def run(*texts):
+        pdf = SimpleNamespace(pages=[_Page(t) for t in texts])
+        monkeypatch.setattr(ocr.pdfplumber, "open", lambda _: nullcontext(pdf))
+        return [(n, t) for n, t, _, _ in ocr.iter_pdf_pages(b"")]
+    return run
+
+
+RESULTS = "HEMOGLOBINA: 14,2 g/dL 13,0 a 17,0"
+METHODS = "Método: enzimático colorimétrico\nMaterial: soro"
+SIGNATURE = "Assinatura eletrônica\nResponsável técnico"
+
+
+def test_results_after_empty_pages_are_kept(pdf_pages):
+    pages = pdf_pages(RESULTS, METHODS, SIGNATURE, "TSH: 2,1 uUI/mL\nFERRITINA 80 ng/mL")
+    assert [n for n, _ in pages] == [1, 4]
+
+
+def test_stop_after_empty_is_opt_in(pdf_pages, monkeypatch):
+    import config
+    monkeypatch.setattr(config, "PDF_STOP_AFTER_EMPTY", 2)
+    assert [n for n, _ in pdf_pages(RESULTS, METHODS, SIGNATURE, "TSH: 2,1 uUI/mL")] == [1]
+
+
+def test_label_at_bottom_of_skipped_page_joins_next_page(pdf_pages):
+    pages = pdf_pages(RESULTS, SIGNATURE + "\nTSH", "2,1 uUI/mL\nFERRITINA 80 ng/mL")
+    assert [n for n, _ in pages] == [1, 3]
+    text = pages[1][1]
+    assert text.splitlines()[-3:] == ["TSH", "2,1 uUI/mL", "FERRITINA 80 ng/mL"]
+    assert parse_lab_text_to_form(text) == {"TSH": 2.1, "FER": 80.0}
+
+
+def test_tail_of_skipped_page_not_joined_without_gain(pdf_pages):
+    pages = pdf_pages(RESULTS, SIGNATURE, "FERRITINA 80 ng/mL")
+    assert pages[1] == (3, "FERRITINA 80 ng/mL")
@@ -0,0 +1,46 @@
+import pytest
+
+from app.parsing.parse import low_confidence, parse_lab_text_scored
+
+
+def test_same_line_value_scores_above_lookahead():
+    form, fields = parse_lab_text_scored("HEMOGLOBINA: 14,2 g/dL\nGLICOSE\n\n92 mg/dL")
+    assert form["HGB"] == 14.2 and form["GLU"] == 92.0
+    hgb, glu = fields["HGB"], fields["GLU"]
+    assert (hgb["line"], hgb["label_line"], hgb["lookahead"]) == (1, 1, False)
+    # linhas contam as em branco (1 = primeira de text.splitlines())
+    assert (glu["line"], glu["label_line"], glu["lookahead"]) == (4, 2, True)
+    assert hgb["unit_ok"] and glu["unit_ok"]
+    assert glu["confidence"] < hgb["confidence"] == 1.0
+
+
+def test_ocr_confidence_scales_score():
+    _, fields = parse_lab_text_scored("HEMOGLOBINA: 14,2 g/dL\nGLICOSE 92 mg/dL", [95.0, 40.0])
+    assert fields["HGB"]["ocr_conf"] == 95.0
+    assert fields["HGB"]["confidence"] == pytest.approx(0.95)
+    assert fields["GLU"]["confidence"] == pytest.approx(0.4)
+
+
+def test_lookahead_uses_lowest_line_confidence():
+    _, fields = parse_lab_text_scored("GLICOSE\n92 mg/dL", [90.0, 50.0])
+    assert fields["GLU"]["ocr_conf"] == 50.0
+
+
+def test_missing_unit_lowers_confidence():
+    _, fields = parse_lab_text_scored("FERRO: 80")
+    assert fields["FE"]["unit"] is None
+    assert fields["FE"]["unit_ok"] is False
+    assert fields["FE"]["confidence"] < 1.0
+
+
+def test_regex_synonym_reports_label_read():
+    _, fields = parse_lab_text_scored("GLU 90 mg/dL")
+    assert fields["GLU"]["synonym"] == "glu"
+    assert "\\" not in fields["GLU"]["synonym"]
+
+
+def test_low_confidence_sorted_weakest_first():
+    fields = {"A": {"confidence": 0.5}, "B": {"confidence": 0.2}, "C": {"confidence": 0.9}}
+    assert low_confidence(fields, 0.6) == ["B", "A"]
+    assert low_confidence(fields, 0.2) == []
+    assert low_confidence({}, 0.6) == []
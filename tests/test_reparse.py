@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import reparse, routes
+from app.fingerprints import source_fp_for
+from app.parsing.ocr import save_source_text
+
+SHA = "a" * 64
+
+
+def test_diff_data_splits_parser_values_from_manual_fixes():
+    old = {"HGB": 14.2, "GLU": 99.0, "TSH": 2.1}
+    base = {"HGB": 14.2, "GLU": 92.0}
+    new = {"HGB": 15.0, "GLU": 95.0, "TSH": 2.1, "FERR": 80.0}
+    apply, manual = reparse.diff_data(old, base, new)
+    assert apply == {"HGB": [14.2, 15.0], "FERR": [None, 80.0]}
+    assert manual == {"GLU": [99.0, 95.0]}
+
+
+def test_diff_data_without_base_only_fills_missing():
+    apply, manual = reparse.diff_data({"HGB": 14.2}, None, {"HGB": 15.0, "GLU": 92.0})
+    assert apply == {"GLU": [None, 92.0]}
+    assert manual == {"HGB": [14.2, 15.0]}
+
+
+def test_parse_source_reads_stored_text(repo):
+    assert reparse.parse_source(SHA) is None
+    assert reparse.parse_source(None) is None
+    save_source_text(SHA, "HEMOGLOBINA: 14,2 g/dL\nGLICOSE 92 mg/dL\n")
+    assert reparse.parse_source(SHA) == {"HGB": 14.2, "GLU": 92.0}
+
+
+@pytest.fixture
+def inline_pool(monkeypatch):
+    # threads no lugar de processos: o tmp_path do teste vale para os workers
+    monkeypatch.setattr(reparse, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+
+def test_run_applies_new_reading_and_keeps_manual_fix(repo, inline_pool, tmp_path):
+    save_source_text(SHA, "HEMOGLOBINA: 14,2 g/dL\nGLICOSE 92 mg/dL\n")
+    base = reparse.parse_source(SHA)
+    [(exam_id, _)] = repo.insert_exams([{"patient_name": "Ana", "age_years": 30, "data": dict(base),
+                                         "source_fp": f"{SHA}:1", "parsed": base}])
+    repo.update_exam(exam_id, {"patient_name": "Ana", "age_years": 30,
+                               "data": {**base, "GLU": 99.0}, "source_fp": f"{SHA}:1"})
+    save_source_text(SHA, "HEMOGLOBINA: 15,0 g/dL\nGLICOSE 95 mg/dL\n")
+
+    report = tmp_path / "report.jsonl"
+    totals = reparse.run(apply=True, workers=1, batch=10, report=str(report))
+    assert totals["written"] == 1 and totals["manual"] == 1 and totals["conflicts"] == 0
+    exam = repo.get_exam(exam_id)
+    assert exam["data"] == {"HGB": 15.0, "GLU": 99.0}
+    [(_, sfp, _, parsed)] = repo.fetch_reparse_batch(0, 10, None)
+    assert sfp == source_fp_for(SHA) and parsed == {"HGB": 15.0, "GLU": 95.0}
+    assert '"manual": {"GLU": [99.0, 95.0]}' in report.read_text(encoding="utf-8")
+
+    # já na versão atual do parser: nada a refazer
+    assert reparse.run(apply=True, workers=1)["seen"] == 0
+
+
+def test_run_without_apply_only_reports(repo, inline_pool):
+    save_source_text(SHA, "HEMOGLOBINA: 14,2 g/dL\n")
+    [(exam_id, _)] = repo.insert_exams([{"patient_name": "Ana", "age_years": 30, "data": {},
+                                         "source_fp": f"{SHA}:1"}])
+    totals = reparse.run(apply=False, workers=1)
+    assert totals["changed"] == 1 and totals["written"] == 0
+    assert repo.get_exam(exam_id)["data"] == {}
+
+
+def test_save_exam_parses_source_off_the_web_process(client, monkeypatch):
+    save_source_text(SHA, "HEMOGLOBINA: 14,2 g/dL\n")
+    calls = []
+
+    def fake_run_cpu(fn, *args):
+        calls.append(fn)
+        return fn(*args)
+
+    monkeypatch.setattr(routes, "run_cpu", fake_run_cpu)
+    resp = client.post("/", data={"patient_name": "Ana", "age_years": "30", "f_HGB": "14,2",
+                                  "source_fp": f"{SHA}:2"})
+    assert resp.status_code == 302
+    assert calls == [reparse.parse_source]
+    [row] = routes.repo.fetch_reparse_batch(0, 10, None)
+    assert row[3] == {"HGB": 14.2}
@@ -0,0 +1,152 @@
+import pytest
+
+from app import blobstore, stats
+from app.storage import DuplicateExamError
+from app.storage.sqlite import SQLiteRepository
+
+SHA_A, SHA_B = "a" * 64, "b" * 64
+
+
+def _exam(name="Ana Souza", age=34, sex="F", data=None, source_fp=None, **extra):
+    return {"patient_name": name, "sex": sex, "age_years": age,
+            "data": {"GLU": 90.0} if data is None else data, "source_fp": source_fp, **extra}
+
+
+def _glu(repo, sex="F", age=34):
+    acc = repo.load_population_stats(sex, age, ["GLU"]).get("GLU", {}).get(stats.ALL_SEXES)
+    return (acc["n"], round(acc["mean"], 6)) if acc else (0, None)
+
+
+def _refcount(repo, sha):
+    with repo._conn() as conn:
+        row = conn.execute("SELECT refcount FROM blobs WHERE sha256=?", (sha,)).fetchone()
+    return row[0] if row else None
+
+
+def _add_blob(repo, sha, data=b"%PDF"):
+    repo.register_blob(sha, len(data), "application/pdf", "laudo.pdf")
+    blobstore.put_blob(sha, data)
+
+
+def test_schema_survives_reopen(repo):
+    [(exam_id, _)] = repo.insert_exams([_exam()])
+    again = SQLiteRepository(repo.path)
+    assert again.get_exam(exam_id)["data"] == {"GLU": 90.0}
+    assert _glu(again) == (1, 90.0)
+
+
+def test_insert_dedupes_by_source_and_flags_same_result(repo):
+    [(a, inserted)] = repo.insert_exams([_exam(source_fp=f"{SHA_A}:2")])
+    assert inserted
+    # mesmo documento: não duplica, devolve o id existente
+    assert repo.insert_exams([_exam(data={"GLU": 1.0}, source_fp=f"{SHA_A}:2")]) == [(a, False)]
+    # outro documento com o mesmo resultado: grava e aponta o anterior
+    other = _exam(source_fp=f"{SHA_B}:2")
+    [(b, inserted)] = repo.insert_exams([other])
+    assert inserted and b != a
+    assert other["same_result_as"] == a
+    assert repo.find_exam_by_result_fp(other["result_fp"], exclude_id=b) == a
+    assert repo.find_exam_by_result_fp(other["result_fp"], exclude_id=a) == b
+    assert _glu(repo) == (2, 90.0)
+
+
+def test_update_moves_stats_and_rejects_taken_source(repo):
+    [(a, _), (b, _)] = repo.insert_exams([_exam(source_fp=f"{SHA_A}:2"), _exam(name="Bia", data={"GLU": 110.0})])
+    assert _glu(repo) == (2, 100.0)
+    assert repo.update_exam(b, _exam(name="Bia", data={"GLU": 130.0}))
+    assert _glu(repo) == (2, 110.0)
+    with pytest.raises(DuplicateExamError):
+        repo.update_exam(b, _exam(name="Bia", source_fp=f"{SHA_A}:2"))
+    # transação desfeita: nada mudou
+    assert repo.get_exam(b)["data"] == {"GLU": 130.0}
+    assert _glu(repo) == (2, 110.0)
+    assert repo.update_exam(999, _exam()) is False
+
+
+def test_remove_updates_stats_and_blob_refcount(repo):
+    _add_blob(repo, SHA_A)
+    [(a, _), (b, _)] = repo.insert_exams([_exam(source_fp=f"{SHA_A}:2"),
+                                          _exam(data={"GLU": 110.0}, source_fp=f"{SHA_A}:1")])
+    assert _refcount(repo, SHA_A) == 2
+    assert repo.get_exam(a)["has_source"]
+    assert repo.remove_exam(a)
+    assert repo.get_exam(a) is None
+    assert _refcount(repo, SHA_A) == 1
+    assert _glu(repo) == (1, 110.0)
+    assert repo.remove_exam(a) is False
+
+
+def test_projection_and_pagination(repo):
+    ids = [i for i, _ in repo.insert_exams([_exam(data={"GLU": 90.0 + n, "HGB": 13.0}) for n in range(3)])]
+    assert repo.fetch_exam(ids[0], ["HGB", "TSH"])["data"] == {"HGB": 13.0}
+    assert repo.fetch_exam(ids[0])["data"] == {"GLU": 90.0, "HGB": 13.0}
+    assert repo.fetch_exam(999) is None
+    page = repo.fetch_exams(["GLU"], limit=2)
+    assert [e["id"] for e in page] == ids[:0:-1]
+    assert [e["data"] for e in page] == [{"GLU": 92.0}, {"GLU": 91.0}]
+    assert [e["id"] for e in repo.fetch_exams(limit=10, before_id=ids[1])] == [ids[0]]
+    assert [e["id"] for e in repo.list_exam_summaries(10, before_id=ids[2])] == ids[1::-1]
+
+
+def test_search_uses_normalized_names(repo):
+    [(a, _)] = repo.insert_exams([_exam(name="Conceição Araújo")])
+    assert [h["id"] for h in repo.search_patients("conceicao araujo")] == [a]
+
+
+def test_apply_reparse_skips_stale_rows(repo):
+    [(a, _)] = repo.insert_exams([_exam(source_fp=f"{SHA_A}:1")])
+    seen = {"GLU": 90.0}
+    repo.update_exam(a, _exam(data={"GLU": 95.0}))
+    written, conflicts = repo.apply_reparse([(a, seen, {"GLU": 91.0}, {"GLU": 91.0}, f"{SHA_A}:2")])
+    assert (written, conflicts) == (0, [a])
+    assert repo.get_exam(a)["data"] == {"GLU": 95.0}
+    assert _glu(repo) == (1, 95.0)
+
+
+def test_apply_reparse_conflict_only_drops_colliding_row(repo):
+    [(a, _), (b, _)] = repo.insert_exams([_exam(source_fp=f"{SHA_A}:1"), _exam(source_fp=f"{SHA_B}:2")])
+    written, conflicts = repo.apply_reparse([
+        (a, {"GLU": 90.0}, {"GLU": 80.0}, {"GLU": 80.0}, f"{SHA_A}:2"),
+        (b, {"GLU": 90.0}, {"GLU": 90.0}, {"GLU": 90.0}, f"{SHA_A}:2"),  # colide com a nova de a
+    ])
+    assert (written, conflicts) == (1, [b])
+    rows = {r[0]: r for r in repo.fetch_reparse_batch(0, 10, None)}
+    assert rows[a][1:] == (f"{SHA_A}:2", {"GLU": 80.0}, {"GLU": 80.0})
+    assert rows[b][1] == f"{SHA_B}:2"
+    assert _glu(repo) == (2, 85.0)
+    assert repo.fetch_reparse_batch(0, 10, "2") == []
+
+
+def test_gc_removes_only_unreferenced_blobs_past_grace(repo):
+    _add_blob(repo, SHA_A)
+    _add_blob(repo, SHA_B)
+    [(a, _)] = repo.insert_exams([_exam(source_fp=f"{SHA_A}:2")])
+    # dentro da carência nada sai, nem o blob sem exame
+    assert repo.collect_unreferenced_blobs(1.0, blobstore.delete_blob) == []
+
+    removed = []
+
+    def remove(sha):
+        removed.append(sha)
+        blobstore.delete_blob(sha)
+
+    assert repo.collect_unreferenced_blobs(0, remove) == [SHA_B] == removed
+    assert blobstore.existing_path(SHA_B) is None and blobstore.existing_path(SHA_A)
+    assert _refcount(repo, SHA_B) is None
+
+    repo.remove_exam(a)
+    assert repo.collect_unreferenced_blobs(0, blobstore.delete_blob, batch=1) == [SHA_A]
+    assert blobstore.existing_path(SHA_A) is None
+
+
+def test_gc_failure_keeps_blob_row(repo):
+    _add_blob(repo, SHA_A)
+
+    def remove(sha):
+        raise OSError("disco")
+
+    with pytest.raises(OSError):
+        repo.collect_unreferenced_blobs(0, remove)
+    # transação desfeita: a linha continua e a próxima coleta tenta de novo
+    assert _refcount(repo, SHA_A) == 0
+    assert repo.collect_unreferenced_blobs(0, blobstore.delete_blob) == [SHA_A]
@@ -0,0 +1,53 @@
+import pytest
+
+from app.parsing.parse import normalize_name
+from app.storage.sqlite import similarity, word_similarity
+
+
+# Valores de referência medidos no pg_trgm (Postgres 18)
+@pytest.mark.parametrize("a, b, sim, word_sim", [
+    ("word", "two words", 0.3636, 0.8),
+    ("maria silva", "maria da silva", 0.8, 0.8),
+    ("mraia", "maria souza", 0.125, 0.2),
+    ("jose antonio", "jose antonio pereira", 0.619, 1.0),
+    ("silva", "maria aparecida da silva", 0.25, 1.0),
+    ("mariana", "maria", 0.5556, 0.625),
+])
+def test_trigram_functions_match_pg_trgm(a, b, sim, word_sim):
+    assert similarity(a, b) == pytest.approx(sim, abs=1e-4)
+    assert word_similarity(a, b) == pytest.approx(word_sim, abs=1e-4)
+
+
+def test_normalize_name_strips_accents_case_and_spaces():
+    assert normalize_name("  José   ANTÔNIO ") == "jose antonio"
+    assert normalize_name(None) == ""
+
+
+def _seed(repo, names):
+    return dict(zip(names, (rid for rid, _ in repo.insert_exams(
+        [{"patient_name": n, "age_years": 40, "data": {}} for n in names]))))
+
+
+def test_search_ranks_closest_first_and_ignores_accents(repo):
+    ids = _seed(repo, ["Maria da Silva", "Marta Silva", "Maria Souza", "José Antônio", "Pedro Alves"])
+    hits = repo.search_patients("maria silva", limit=3)
+    assert [h["id"] for h in hits] == [ids["Maria da Silva"], ids["Marta Silva"], ids["Maria Souza"]]
+    assert hits[0]["score"] == pytest.approx(0.8)
+    assert [h["id"] for h in repo.search_patients("JOSE ANTONIO")] == [ids["José Antônio"]]
+
+
+def test_search_tolerates_ocr_typos_above_threshold(repo):
+    ids = _seed(repo, ["Antonia Pereira", "Pedro Alves"])
+    assert [h["id"] for h in repo.search_patients("antonia pereria")] == [ids["Antonia Pereira"]]
+    assert repo.search_patients("zzz") == []
+    assert repo.search_patients("   ") == []
+
+
+def test_search_ties_broken_by_similarity_then_newest(repo):
+    ids = _seed(repo, ["Maria", "Maria Aparecida da Silva", "Maria"])
+    hits = repo.search_patients("maria", limit=10)
+    assert {h["score"] for h in hits} == {1.0}
+    # nome inteiro igual ganha do nome que só contém a palavra; depois o mais novo
+    assert [h["id"] for h in hits][-1] == ids["Maria Aparecida da Silva"]
+    assert hits[0]["id"] > hits[1]["id"]
+    assert len(repo.search_patients("maria", limit=1)) == 1
@@ -0,0 +1,66 @@
+import math
+import random
+import statistics
+
+import pytest
+
+from app import stats
+
+
+def _acc(values):
+    acc = stats.new_acc()
+    for x in values:
+        stats.add_sample(acc, x, +1)
+    return acc
+
+
+def test_mean_and_variance_match_statistics():
+    xs = [random.Random(1).uniform(50, 150) for _ in range(500)]
+    acc = _acc(xs)
+    assert acc["n"] == 500
+    assert acc["mean"] == pytest.approx(statistics.fmean(xs))
+    assert math.sqrt(acc["m2"] / (acc["n"] - 1)) == pytest.approx(statistics.stdev(xs))
+
+
+def test_remove_undoes_add():
+    acc = _acc([90.0, 100.0, 110.0])
+    stats.add_sample(acc, 110.0, -1)
+    assert acc["n"] == 2
+    assert acc["mean"] == pytest.approx(95.0)
+    assert acc["sketch"] == _acc([90.0, 100.0])["sketch"]
+    stats.add_sample(acc, 90.0, -1)
+    stats.add_sample(acc, 100.0, -1)
+    assert acc == stats.new_acc()
+
+
+def test_quantile_relative_error_within_alpha():
+    rng = random.Random(7)
+    xs = sorted(rng.lognormvariate(4, 0.5) for _ in range(2000))
+    acc = _acc(xs)
+    for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+        exact = xs[int(q * (len(xs) - 1))]
+        assert stats.quantile(acc, q) == pytest.approx(exact, rel=2 * stats.SKETCH_ALPHA)
+
+
+def test_percentile_rank_and_zero_bucket():
+    acc = _acc([0.0, 0.0, 10.0, 20.0, 30.0, 40.0])
+    assert stats.percentile_rank(acc, -1.0) == pytest.approx(100 * 1 / 6)
+    assert stats.percentile_rank(acc, 25.0) == pytest.approx(100 * 4 / 6)
+    # o balde do próprio valor conta pela metade
+    assert stats.percentile_rank(acc, 20.0) == pytest.approx(100 * 3.5 / 6)
+    assert stats.percentile_rank(acc, 1000.0) == 100.0
+    assert stats.percentile_rank(stats.new_acc(), 5.0) is None
+
+
+def test_exam_deltas_feed_sex_and_all_groups():
+    accs = {}
+    stats.accumulate(accs, stats.exam_deltas("f", 34, {"GLU": 92, "X": "pos", "B": True}, +1))
+    assert set(accs) == {("GLU", 30, "*"), ("GLU", 30, "F")}
+
+
+def test_describe_falls_back_to_all_sexes():
+    accs = {"F": _acc([90.0] * 3), "*": _acc([90.0] * 3 + [100.0] * 3)}
+    d = stats.describe(accs, "F", 34, 100.0, min_n=5)
+    assert d["n"] == 6 and d["group"] == "pessoas de 30–39 anos"
+    assert stats.describe(accs, "F", 34, 100.0, min_n=10) is None
+    assert stats.describe(accs, "F", 34, 100.0, min_n=0)["group"] == "mulheres de 30–39 anos"